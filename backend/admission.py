@@ -0,0 +1,208 @@
+"""Admission control for chaos actions: per-region serialization, coalescing and per-client rate limits.
+
+Actions against a region run one at a time across every worker. Within a
+worker, waiters queue in order on an asyncio lock. Across workers, a
+per-region flock serializes them.
+
+A request identical to the action already queued last for its region joins
+that action instead of queuing behind it. A request that waited on another
+worker's identical action reuses that action's result. Either way, recover
+after recover runs once.
+
+Clients are rate limited by a token bucket per address that is shared by
+all workers. Rejections carry a Retry-After hint. The address is the TCP
+peer. X-Forwarded-For is honoured only when the peer is one of
+``ADMISSION_TRUSTED_PROXIES``.
+"""
+import asyncio
+import ipaddress
+import json
+import math
+import os
+import time
+
+import shared_state
+
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE_PER_MIN", "30")) / 60
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "10"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "8"))
+# Kept well below the gunicorn worker timeout so queued requests fail fast instead
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+# Comma-separated addresses or CIDRs of reverse proxies whose X-Forwarded-For is believed; none by default
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False)
+                   for p in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+RATE_FILE = "ratelimit.json"
+RATE_LOCK = "ratelimit.lock"
+
+
+def _trusted(address, proxies):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in net for net in proxies)
+
+
+def client_key(peer, forwarded=None, proxies=None):
+    """Rate-limit key for a request from ``peer`` carrying an X-Forwarded-For of ``forwarded``
+
+    Behind trusted proxies, the key is the nearest address in the chain that is not itself a
+    trusted proxy; anything further left was written by the client and is ignored.
+    """
+    proxies = TRUSTED_PROXIES if proxies is None else proxies
+    if not peer:
+        return "unknown"
+    if not forwarded or not _trusted(peer, proxies):
+        return peer
+    for address in reversed([a.strip() for a in forwarded.split(",") if a.strip()]):
+        if not _trusted(address, proxies):
+            return address
+    return peer
+
+
+class AdmissionRejected(Exception):
+    """Raised when an action is not admitted; ``retry_after`` is in whole seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _QueueTimeout(Exception):
+    """The regions were not free within the queue timeout"""
+
+
+class _Pending:
+    def __init__(self, key):
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionControl:
+    def __init__(self, rate=ADMISSION_RATE, burst=ADMISSION_BURST, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._locks = {}
+        self._tails = {}
+        self._waiting = {}
+        self._durations = {}
+        self.stats = {"admitted": 0, "executed": 0, "coalesced": 0, "rate_limited": 0, "queue_rejected": 0}
+
+    def check_rate(self, client):
+        """Take one token from the client's bucket or raise AdmissionRejected"""
+        now = time.time()
+        with shared_state.FileLock(RATE_LOCK):
+            buckets = shared_state.read_json(RATE_FILE, {})
+            tokens, last = buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.stats["rate_limited"] += 1
+                raise AdmissionRejected(f"Rate limit exceeded for {client}", (1 - tokens) / self.rate)
+            buckets[client] = (tokens - 1, now)
+            # Forget clients whose bucket has refilled anyway
+            buckets = {c: b for c, b in buckets.items() if now - b[1] < self.burst / self.rate}
+            shared_state.write_json(RATE_FILE, buckets)
+
+    def _retry_hint(self, regions):
+        """Seconds until the queue has probably drained, from recent action durations"""
+        avg = max((self._durations.get(r, 1.0) for r in regions), default=1.0)
+        return avg * (max(self._waiting.get(r, 0) for r in regions) + 1)
+
+    async def run(self, regions, action, params, fn):
+        """Run ``fn()`` once no other action holds any of ``regions``; returns (result, coalesced)"""
+        regions = sorted(set(regions))
+        key = json.dumps([regions, action, params], sort_keys=True, default=str)
+        tail_key = tuple(regions)
+        tail = self._tails.get(tail_key)
+        if tail is not None and tail.key == key and not tail.future.done():
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(tail.future), True
+
+        if any(self._waiting.get(r, 0) >= self.max_queue for r in regions):
+            self.stats["queue_rejected"] += 1
+            raise AdmissionRejected(f"Too many queued actions for {', '.join(regions)}", self._retry_hint(regions))
+
+        pending = _Pending(key)
+        self._tails[tail_key] = pending
+        for r in regions:
+            self._waiting[r] = self._waiting.get(r, 0) + 1
+        arrived = time.time()
+        try:
+            result, coalesced = await self._run_locked(regions, key, arrived, fn)
+            pending.future.set_result(result)
+            return result, coalesced
+        except _QueueTimeout:
+            self.stats["queue_rejected"] += 1
+            error = AdmissionRejected(f"Timed out waiting for earlier actions on {', '.join(regions)}",
+                                      self._retry_hint(regions))
+            pending.future.set_exception(error)
+            raise error
+        except BaseException as e:
+            if not pending.future.done():
+                pending.future.set_exception(e)
+            raise
+        finally:
+            # Joiners await the future; nobody else will retrieve an unused exception
+            if pending.future.done() and not pending.future.cancelled():
+                pending.future.exception()
+            for r in regions:
+                self._waiting[r] -= 1
+            if self._tails.get(tail_key) is pending:
+                del self._tails[tail_key]
+
+    async def _acquire(self, locks, files, held):
+        for lock in locks:
+            await lock.acquire()
+            held.append(lock)
+        for f in files:
+            while not f.try_acquire():
+                await asyncio.sleep(0.02)
+
+    async def _run_locked(self, regions, key, arrived, fn):
+        locks = [self._locks.setdefault(r, asyncio.Lock()) for r in regions]
+        files = [shared_state.FileLock(f"region-{r}.lock") for r in regions]
+        held = []
+        try:
+            # Only the wait for the regions is bounded: an admitted action always runs to completion
+            try:
+                await asyncio.wait_for(self._acquire(locks, files, held), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise _QueueTimeout()
+            # The same action finished in another worker while this one waited, and nothing else ran
+            # on any of its regions since: reuse it
+            lasts = [shared_state.read_json(f"region-{r}.last.json") for r in regions]
+            if all(last and last["key"] == key and last["finished_at"] >= arrived for last in lasts):
+                self.stats["coalesced"] += 1
+                return lasts[0]["result"], True
+
+            self.stats["admitted"] += 1
+            started = time.monotonic()
+            result = await fn()
+            duration = time.monotonic() - started
+            for r in regions:
+                self._durations[r] = duration
+                shared_state.write_json(f"region-{r}.last.json", {"key": key, "finished_at": time.time(), "result": result})
+            self.stats["executed"] += 1
+            return result, False
+        finally:
+            for f in files:
+                f.release()
+            for lock in held:
+                lock.release()
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "pid": os.getpid(),
+            "waiting": {r: n for r, n in self._waiting.items() if n},
+            "rate_per_min": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+        }
@@ -1,17 +1,66 @@
 
 import os
 import asyncio
-import random
-import subprocess
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from urllib.parse import urlparse
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-import requests
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
-app = FastAPI()
+from admission import AdmissionControl, AdmissionRejected, client_key
+from bulk_writes import WRITERS, percentile, random_amounts
+from cluster_health import ClusterHealth
+from db_pool import ConnectionPool
+from docker_client import DockerClient, DockerError
+from fanout import Op, run_together
+from lifecycle import WorkerLifecycle
+import metrics
+from network_cache import NetworkCache
+from node_probe import NodeProber
+from reconciler import ToxicReconciler, desired_state
+from scenarios import ScenarioBusy, ScenarioError, ScenarioRunner
+from shared_counter import SharedCounter
+from shared_latency import SharedLatency
+from snapshot import SnapshotService, age as snapshot_age
+from stream import event_stream
+from timeline import EXPORT_FORMATS, Timeline
+from ttr import Prober, TTRTracker
+from toxics import CATALOGUE, STREAMS, ToxicError, parse_toxics
+from toxiproxy_client import ToxiproxyClient, latency_toxic
+
+toxiproxy = ToxiproxyClient()
+docker = DockerClient()
+networks = NetworkCache(docker)
+reconciler = ToxicReconciler(toxiproxy)
+admission = AdmissionControl()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs before uvicorn accepts connections on this worker, so no request meets cold pools
+    await lifecycle.warm()
+    tasks = [
+        asyncio.create_task(lifecycle.run()),
+        asyncio.create_task(snapshot.run()),
+        asyncio.create_task(_evict_down_gateways()),
+        asyncio.create_task(networks.watch()),
+        asyncio.create_task(timeline.run()),
+        asyncio.create_task(ttr.run_baseline()),
+        asyncio.create_task(node_prober.run())
+    ]
+    yield
+    # Recycled or stopping: let chaos work already in flight finish before cancelling it
+    await lifecycle.drain(scenarios.drain, ttr.drain)
+    for task in tasks:
+        task.cancel()
+    scenarios.cancel()
+    ttr.cancel_all()
+    await toxiproxy.aclose()
+    await docker.aclose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 
 EAST_API = os.getenv("EAST_API", "http://toxiproxy-east:8474")
 WEST_API = os.getenv("WEST_API", "http://toxiproxy-west:8474")
@@ -32,36 +81,19 @@ DB_PORT = os.getenv("DB_PORT", "26257")
 DB_USER = os.getenv("DB_USER", "root")
 DB_NAME = os.getenv("DB_NAME", "defaultdb")
 
-transaction_count = 0
+SIMULATE_WRITES_MAX_ROWS = int(os.getenv("SIMULATE_WRITES_MAX_ROWS", "1000000"))
 
-def _get_docker_network():
-    """Dynamically detect the Docker Compose network name"""
-    try:
-        # Try common network name patterns
-        for pattern in ["cockroach-chaos-demo_default", "default"]:
-            result = subprocess.run(
-                ["docker", "network", "ls", "--filter", f"name={pattern}", "--format", "{{.Name}}"],
-                capture_output=True,
-                timeout=3,
-                text=True
-            )
-            if result.returncode == 0 and result.stdout.strip():
-                return result.stdout.strip().split('\n')[0]
-        
-        # Fallback: inspect one of our containers to get its network
-        result = subprocess.run(
-            ["docker", "inspect", "-f", "{{range $key, $value := .NetworkSettings.Networks}}{{$key}}{{end}}", "crdb-e1a"],
-            capture_output=True,
-            timeout=3,
-            text=True
-        )
-        if result.returncode == 0 and result.stdout.strip():
-            return result.stdout.strip().split('\n')[0]
-    except Exception:
-        pass
-    
-    # Default fallback
-    return "cockroach-chaos-demo_default"
+db_pool = ConnectionPool({"host": DB_HOST, "port": DB_PORT, "user": DB_USER, "database": DB_NAME, "connect_timeout": 3})
+
+# Node/range/replica counts; the range descriptor scan is cached until the gossiped range counts change
+cluster_health_query = ClusterHealth(db_pool)
+
+# Fault recovery probes use their own connections so pool eviction never interferes
+ttr = TTRTracker(Prober({"host": DB_HOST, "port": DB_PORT, "user": DB_USER, "database": DB_NAME}))
+
+# Writes made through this backend, counted across all workers
+transactions = SharedCounter()
+write_latency = SharedLatency()
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -83,248 +115,683 @@ def get_config(request: Request):
         "hostname": hostname
     }
 
-def _list_proxies(api):
-    r = requests.get(f"{api}/proxies", timeout=3)
-    r.raise_for_status()
-    data = r.json()
-    # Toxiproxy returns a dict, not an array
-    if isinstance(data, dict):
-        return data
-    return {p["name"]: p for p in data}
-
-def _set_enabled(api, name, enabled: bool):
-    r = requests.post(f"{api}/proxies/{name}", json={"enabled": enabled}, timeout=3)
-    if r.status_code == 404:
-        raise HTTPException(404, f"Proxy {name} not found at {api}")
-    r.raise_for_status()
-
-def _add_latency(api, name, ms):
-    tname = "latency"
-    requests.post(f"{api}/proxies/{name}/toxics", json={
-        "name": tname, "type": "latency", "stream": "downstream",
-        "attributes": {"latency": int(ms), "jitter": int(ms/3)}
-    }, timeout=3)
-
-def _clear_toxics(api, name):
-    r = requests.get(f"{api}/proxies/{name}/toxics", timeout=3)
-    if r.status_code == 200:
-        for toxic in r.json():
-            requests.delete(f"{api}/proxies/{name}/toxics/{toxic['name']}", timeout=3)
-
-def _check_containers_running(containers):
+async def _container_states():
+    """Fetch the state of every container in a single Docker API call"""
+    try:
+        return await docker.container_states()
+    except Exception:
+        return None
+
+def _check_containers_running(containers, states):
     """Check if all containers in the list are running"""
+    if states is None:
+        return True  # Default to true if we can't check (fail open)
+    return all(states.get(c) == "running" for c in containers)
+
+def _region_status(cfg, proxies, states):
+    if isinstance(proxies, Exception):
+        return {"up": False, "error": str(proxies)}
     try:
-        result = subprocess.run(
-            ["docker", "ps", "--filter", "status=running", "--format", "{{.Names}}"],
-            capture_output=True,
-            timeout=5,
-            text=True
-        )
-        if result.returncode == 0:
-            running_containers = set(result.stdout.strip().split('\n'))
-            return all(c in running_containers for c in containers)
+        proxies_enabled = any(proxies.get(n, {}).get("enabled", False) for n in cfg["proxies"])
+        containers_running = _check_containers_running(cfg["containers"], states)
+        
+        # Region is up only if BOTH proxies are enabled AND containers are running
+        up = proxies_enabled and containers_running
+        
+        return {
+            "up": up,
+            "proxies": {n: proxies.get(n, {}) for n in cfg["proxies"]},
+            "containers_running": containers_running
+        }
+    except Exception as e:
+        return {"up": False, "error": str(e)}
+
+async def _collect_status():
+    # Query all regional Toxiproxy APIs and Docker at once instead of one after another
+    observed_at = time.time()
+    listings, states = await asyncio.gather(
+        toxiproxy.list_proxies_many([cfg["api"] for cfg in REGIONS.values()]),
+        _container_states()
+    )
+    for api, proxies in listings.items():
+        if not isinstance(proxies, Exception):
+            reconciler.observe(api, proxies, observed_at)
+    return {region: _region_status(cfg, listings[cfg["api"]], states) for region, cfg in REGIONS.items()}
+
+async def _collect_snapshot():
+    status, health = await asyncio.gather(_collect_status(), asyncio.to_thread(_query_cluster_health))
+    return {"status": status, "cluster_health": health}
+
+snapshot = SnapshotService(_collect_snapshot)
+
+async def _warm_toxiproxy():
+    """Open a keep-alive connection to each regional API and seed the reconciler cache"""
+    observed_at = time.time()
+    listings = await toxiproxy.list_proxies_many([cfg["api"] for cfg in REGIONS.values()])
+    failed = [f"{api}: {proxies}" for api, proxies in listings.items() if isinstance(proxies, Exception)]
+    for api, proxies in listings.items():
+        if not isinstance(proxies, Exception):
+            reconciler.observe(api, proxies, observed_at)
+    if failed:
+        raise RuntimeError("; ".join(failed))
+
+async def _warm_docker():
+    await docker.ping()
+    await networks.resolve()
+
+async def _warm_cluster_health():
+    health = await asyncio.to_thread(cluster_health_query.query)
+    if "error" in health:
+        raise RuntimeError(health["error"])
+
+lifecycle = WorkerLifecycle({
+    "db_pool": lambda: asyncio.to_thread(db_pool.prewarm),
+    "toxiproxy": _warm_toxiproxy,
+    "docker": _warm_docker,
+    "cluster_health": _warm_cluster_health,
+    "snapshot": snapshot.get,
+    "ttr_probe": lambda: asyncio.get_running_loop().run_in_executor(ttr.prober.executor(), ttr.prober.ensure_table),
+})
+
+def warm_after_fork():
+    """gunicorn post_fork: register the worker and open its pooled connections before its event loop starts"""
+    lifecycle.post_fork()
+    try:
+        db_pool.prewarm()
     except Exception:
-        pass
-    return True  # Default to true if we can't check (fail open)
+        pass  # The lifespan warm-up retries and reports it
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """200 once this worker's pools and caches are warm; 503 while warming, degraded or draining"""
+    if not lifecycle.ready():
+        response.status_code = 503
+    return {**lifecycle.snapshot(), "workers": lifecycle.workers()}
+
+def _region_states():
+    snap = snapshot.current()
+    if snap is None or snapshot_age(snap) > snapshot.max_age:
+        return None
+    return {region: info.get("up") for region, info in snap["data"]["status"].items()}
+
+timeline = Timeline(transactions, write_latency, _region_states, REGIONS)
+
+_node_targets = {}
+
+def _probe_targets():
+    """Each node's Toxiproxy listener, learned from the proxy listings in the snapshot"""
+    snap = snapshot.current()
+    if snap is not None:
+        for region, cfg in REGIONS.items():
+            proxies = snap["data"]["status"].get(region, {}).get("proxies", {})
+            for name in cfg["proxies"]:
+                listen = proxies.get(name, {}).get("listen")
+                if listen:
+                    port = int(listen.rsplit(":", 1)[1])
+                    _node_targets[name] = {"region": region, "host": urlparse(cfg["api"]).hostname, "port": port}
+    return _node_targets
+
+node_prober = NodeProber({"user": DB_USER, "dbname": DB_NAME}, _probe_targets)
+
+def _snapshot_meta(snap):
+    return {"version": snap["version"], "age_ms": int(snapshot_age(snap) * 1000)}
+
+def _set_snapshot_headers(response, snap):
+    meta = _snapshot_meta(snap)
+    response.headers["X-Snapshot-Version"] = str(meta["version"])
+    response.headers["X-Snapshot-Age-Ms"] = str(meta["age_ms"])
+
+def _staleness(max_staleness_ms):
+    return None if max_staleness_ms is None else max(0, max_staleness_ms) / 1000
 
 @app.get("/api/status")
-def status():
-    result = {}
-    for region, cfg in REGIONS.items():
-        try:
-            proxies = _list_proxies(cfg["api"])
-            proxies_enabled = any(proxies.get(n, {}).get("enabled", False) for n in cfg["proxies"])
-            containers_running = _check_containers_running(cfg["containers"])
-            
-            # Region is up only if BOTH proxies are enabled AND containers are running
-            up = proxies_enabled and containers_running
-            
-            result[region] = {
-                "up": up,
-                "proxies": {n: proxies.get(n, {}) for n in cfg["proxies"]},
-                "containers_running": containers_running
-            }
-        except Exception as e:
-            result[region] = {"up": False, "error": str(e)}
-    return result
+async def status(response: Response, max_staleness_ms: int = None):
+    snap = await snapshot.get(_staleness(max_staleness_ms))
+    _set_snapshot_headers(response, snap)
+    return snap["data"]["status"]
+
+@app.get("/api/coalescing")
+def coalescing_stats():
+    """How many status/cluster-health refreshes were coalesced, within and across workers"""
+    return snapshot.coalescing_stats()
+
+@app.get("/api/snapshot")
+async def get_snapshot():
+    """Full shared snapshot (region status + cluster health) with its version and age"""
+    snap = await snapshot.get()
+    return {**_snapshot_meta(snap), "collected_at": snap["collected_at"], "data": snap["data"]}
+
+def _proxy_op(cfg, name, enabled: bool, latency_ms=None):
+    """Reconcile a proxy to an enabled flag and optional latency, with no other toxics"""
+    api = cfg["api"]
+    desired = desired_state(enabled, [latency_toxic(latency_ms)] if latency_ms is not None else [])
+    
+    async def run(mark):
+        # Only the differences are sent; disabling still happens first and marks the fault
+        return {"calls": await reconciler.apply(api, name, desired, mark)}
+    
+    action = "latency" if latency_ms is not None else ("enable" if enabled else "disable")
+    return Op(name, "proxy", action, run)
+
+def _proxy_ops(cfg, enabled: bool, latency_ms=None):
+    return [_proxy_op(cfg, name, enabled, latency_ms) for name in cfg["proxies"]]
+
+def _disconnect_op(container):
+    async def run(mark):
+        await networks.run_op(docker.network_disconnect, container)
+        networks.mark(container, attached=False)
+    return Op(container, "container", "disconnect", run)
+
+def _kill_op(container):
+    async def run(mark):
+        # SIGKILL (like kill -9) for abrupt failure
+        await docker.kill(container, signal="SIGKILL")
+    return Op(container, "container", "kill", run)
+
+def _recover_op(container, reconnect: bool, start: bool):
+    async def run(mark):
+        if reconnect:
+            try:
+                await networks.run_op(docker.network_connect, container)
+            except DockerError as e:
+                # 403 means the container was already connected
+                if e.status_code != 403:
+                    raise
+            networks.mark(container, attached=True)
+        if start:
+            await docker.start(container)
+    action = "+".join(a for a, wanted in (("reconnect", reconnect), ("start", start)) if wanted)
+    return Op(container, "container", action, run)
+
+def _record_action(action, region, result, **detail):
+    """Add a chaos action to the timeline, stamped with the moment its ops were released"""
+    released = datetime.fromisoformat(result["released_at"]).timestamp() if result["released_at"] else None
+    timeline.event(action, region, at=released, ok=all(t["ok"] for t in result["timings"]), **detail)
+
+def _measure_ttr(measurement, result):
+    """Hand the measurement the moment the first op took effect, or drop it if none did"""
+    effective = [datetime.fromisoformat(t["effective_at"]).timestamp() for t in result["timings"] if t["ok"]]
+    if not effective:
+        measurement.cancel()
+        return None
+    measurement.fault(min(effective))
+    return {"id": measurement.id, "status_url": f"/api/ttr/{measurement.id}"}
+
+def _succeeded(result, action):
+    """Targets whose op for ``action`` completed without error"""
+    return [t["target"] for t in result["timings"] if t["ok"] and action in t["action"].split("+")]
+
+def _outcome(action, result):
+    """True if every op succeeded, False if only some did; raises 502 when none did"""
+    failed = [t for t in result["timings"] if not t["ok"]]
+    if failed and len(failed) == len(result["timings"]):
+        raise HTTPException(502, f"{action} failed: " + "; ".join(f"{t['target']}: {t['error']}" for t in failed))
+    return not failed
+
+def _client(request):
+    return client_key(request.client.host if request.client else None, request.headers.get("x-forwarded-for"))
+
+async def _admit(request, regions, action, params, run, response=None):
+    """Rate limit the caller (scenario steps pass no request), then queue behind other actions on the regions
+
+    An action that only partly succeeded is answered with 207 and ``"ok": false``.
+    """
+    try:
+        if request is not None:
+            admission.check_rate(_client(request))
+        result, coalesced = await admission.run(regions, action, params, run)
+    except AdmissionRejected as e:
+        raise HTTPException(429, e.reason, headers={"Retry-After": str(e.retry_after)})
+    if response is not None and not result["ok"]:
+        response.status_code = 207
+    return {**result, "coalesced": coalesced}
 
 @app.post("/api/partition/{region}")
-def partition_region(region: str):
+async def partition_region(region: str, request: Request = None, response: Response = None):
     """Simulate network partition by disconnecting containers from bridge network"""
     if region not in REGIONS: raise HTTPException(404, "Unknown region")
+    return await _admit(request, [region], "partition", {}, lambda: _partition(region), response)
+
+async def _partition(region):
     cfg = REGIONS[region]
-    disconnected = []
-    network_name = _get_docker_network()
-    
-    for container in cfg["containers"]:
-        try:
-            result = subprocess.run(
-                ["docker", "network", "disconnect", network_name, container],
-                capture_output=True, 
-                timeout=5
-            )
-            if result.returncode == 0:
-                disconnected.append(container)
-        except Exception as e:
-            pass
+    await networks.resolve()
     
-    # Also disable toxiproxy to block external access
-    for name in cfg["proxies"]:
-        _clear_toxics(cfg["api"], name)
-        _set_enabled(cfg["api"], name, False)
+    # Also disable toxiproxy to block external access; every op starts at the same instant
+    ops = [_disconnect_op(c) for c in cfg["containers"] if networks.is_attached(c) is not False]
+    measurement = ttr.start("partition", region)
+    result = await run_together(ops + _proxy_ops(cfg, enabled=False))
+    ttr_ref = _measure_ttr(measurement, result)
     
-    return {"ok": True, "region": region, "action": "partition", "disconnected": disconnected}
+    db_pool.evict_gateway(region)
+    _record_action("partition", region, result)
+    snapshot.request_refresh()
+    return {"ok": _outcome("partition", result), "region": region, "action": "partition", "disconnected": _succeeded(result, "disconnect"), "ttr": ttr_ref, **result}
 
 @app.post("/api/recover/{region}")
-def recover_region(region: str):
+async def recover_region(region: str, request: Request = None, response: Response = None):
     """Recover from network partition or node failure"""
     if region not in REGIONS: raise HTTPException(404, "Unknown region")
+    return await _admit(request, [region], "recover", {}, lambda: _recover(region), response)
+
+async def _recover(region):
     cfg = REGIONS[region]
+    await networks.resolve()
+    states = await _container_states() or {}
     
-    # Reconnect to network
-    network_name = _get_docker_network()
-    reconnected = []
+    # Reconnect/restart containers while the proxies are re-enabled
+    ops = []
     for container in cfg["containers"]:
-        try:
-            # Try to reconnect (will fail if already connected, which is fine)
-            subprocess.run(
-                ["docker", "network", "connect", network_name, container],
-                capture_output=True,
-                timeout=5
-            )
-            reconnected.append(container)
-        except Exception:
-            pass
-    
-    # Restart containers if they're not running
-    started = []
-    for container in cfg["containers"]:
-        try:
-            # Check if container is running
-            check = subprocess.run(
-                ["docker", "inspect", "-f", "{{.State.Running}}", container],
-                capture_output=True,
-                timeout=5,
-                text=True
-            )
-            if check.returncode == 0 and check.stdout.strip() == "false":
-                result = subprocess.run(["docker", "start", container], capture_output=True, timeout=10)
-                if result.returncode == 0:
-                    started.append(container)
-        except Exception:
-            pass
-    
-    # Enable proxies
-    for name in cfg["proxies"]:
-        _clear_toxics(cfg["api"], name)
-        _set_enabled(cfg["api"], name, True)
+        reconnect = networks.is_attached(container) is not True
+        start = states.get(container, "running") != "running"
+        if reconnect or start:
+            ops.append(_recover_op(container, reconnect, start))
+    result = await run_together(ops + _proxy_ops(cfg, enabled=True))
     
-    return {"ok": True, "region": region, "action": "recover", "reconnected": reconnected, "started": started}
+    _record_action("recover", region, result)
+    snapshot.request_refresh()
+    return {
+        "ok": _outcome("recover", result), "region": region, "action": "recover",
+        "reconnected": _succeeded(result, "reconnect"), "started": _succeeded(result, "start"), **result
+    }
 
 @app.post("/api/brownout/{region}")
-def brownout_region(region: str, ms: int = 700):
+async def brownout_region(region: str, ms: int = 700, request: Request = None, response: Response = None):
     """Simulate degraded network performance with latency"""
     if region not in REGIONS: raise HTTPException(404, "Unknown region")
+    return await _admit(request, [region], "brownout", {"ms": ms}, lambda: _brownout(region, ms), response)
+
+async def _brownout(region, ms):
     cfg = REGIONS[region]
     
-    for name in cfg["proxies"]:
-        _clear_toxics(cfg["api"], name)
-        _set_enabled(cfg["api"], name, True)
-        _add_latency(cfg["api"], name, ms)
+    result = await run_together(_proxy_ops(cfg, enabled=True, latency_ms=ms))
     
-    return {"ok": True, "region": region, "action": "brownout", "latency_ms": ms}
+    _record_action("brownout", region, result, latency_ms=ms)
+    snapshot.request_refresh()
+    return {"ok": _outcome("brownout", result), "region": region, "action": "brownout", "latency_ms": ms, **result}
 
 @app.post("/api/kill/{region}")
-def kill_nodes(region: str):
+async def kill_nodes(region: str, request: Request = None, response: Response = None):
     """Abrupt node failure using docker kill (SIGKILL) - simulates crash"""
     if region not in REGIONS: raise HTTPException(404, "Unknown region")
+    return await _admit(request, [region], "kill", {}, lambda: _kill(region), response)
+
+async def _kill(region):
     cfg = REGIONS[region]
-    killed = []
-    
-    for container in cfg["containers"]:
-        try:
-            # Use docker kill with SIGKILL (like kill -9) for abrupt failure
-            result = subprocess.run(
-                ["docker", "kill", "-s", "SIGKILL", container],
-                capture_output=True,
-                timeout=10
-            )
-            if result.returncode == 0:
-                killed.append(container)
-        except Exception as e:
-            pass
     
     # Also disable toxiproxy to block external access
-    for name in cfg["proxies"]:
-        _clear_toxics(cfg["api"], name)
-        _set_enabled(cfg["api"], name, False)
+    ops = [_kill_op(c) for c in cfg["containers"]]
+    measurement = ttr.start("kill", region)
+    result = await run_together(ops + _proxy_ops(cfg, enabled=False))
+    ttr_ref = _measure_ttr(measurement, result)
+    
+    db_pool.evict_gateway(region)
+    _record_action("kill", region, result)
+    snapshot.request_refresh()
+    return {"ok": _outcome("kill", result), "region": region, "action": "kill", "killed": _succeeded(result, "kill"), "ttr": ttr_ref, **result}
+
+def _toxic_targets(targets):
+    """{proxy: region} for {"regions": [...], "proxies": [...]}; region "all" means every proxy"""
+    if not isinstance(targets, dict) or not (targets.get("regions") or targets.get("proxies")):
+        raise HTTPException(400, "'targets' needs a 'regions' and/or 'proxies' list")
+    for key in ("regions", "proxies"):
+        names = targets.get(key) or []
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            raise HTTPException(400, f"'targets.{key}' must be a list of names")
+    regions = targets.get("regions") or []
+    if "all" in regions:
+        regions = list(REGIONS)
+    found = {}
+    for region in regions:
+        if region not in REGIONS:
+            raise HTTPException(404, f"Unknown region {region}")
+        for name in REGIONS[region]["proxies"]:
+            found[name] = region
+    for name in targets.get("proxies") or []:
+        region = next((r for r, cfg in REGIONS.items() if name in cfg["proxies"]), None)
+        if region is None:
+            raise HTTPException(404, f"Unknown proxy {name}")
+        found[name] = region
+    return found
+
+def _toxic_set_op(cfg, name, toxics, replace: bool):
+    """Reconcile a proxy's toxics to a set, keeping its enabled flag (and, when merging, other toxics)
+
+    A merged toxic replaces any current one of the same type and stream, whatever its name,
+    so two latency toxics never add up.
+    """
+    api = cfg["api"]
+    names = {t["name"] for t in toxics}
+    kinds = {(t["type"], t["stream"]) for t in toxics}
     
-    return {"ok": True, "region": region, "action": "kill", "killed": killed}
+    async def run(mark):
+        current = await reconciler.current(api, name)
+        keep = [] if replace else [
+            t for n, t in current["toxics"].items() if n not in names and (t["type"], t["stream"]) not in kinds
+        ]
+        desired = desired_state(current["enabled"], keep + toxics)
+        return {"calls": await reconciler.apply(api, name, desired, mark)}
+    
+    return Op(name, "proxy", "toxics", run)
 
-def get_db_conn():
+async def _body(request):
     try:
-        return psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            database=DB_NAME,
-            connect_timeout=3
-        )
-    except Exception as e:
-        return None
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(400, "Body must be JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Body must be a JSON object")
+    return body
 
-@app.get("/api/cluster-health")
-def cluster_health():
+@app.get("/api/toxics")
+async def list_toxics():
+    """Toxic catalogue (types, attribute defaults, streams) and the toxics currently on every proxy"""
+    snap = await snapshot.get()
+    proxies = {}
+    for region, cfg in REGIONS.items():
+        listing = snap["data"]["status"].get(region, {}).get("proxies", {})
+        for name in cfg["proxies"]:
+            proxy = listing.get(name, {})
+            proxies[name] = {"region": region, "enabled": proxy.get("enabled"), "toxics": proxy.get("toxics", [])}
+    return {"catalogue": CATALOGUE, "streams": STREAMS, "proxies": proxies}
+
+@app.post("/api/toxics")
+async def apply_toxics(request: Request, response: Response):
+    """Apply a compound toxic set to proxies and/or regions in one request.
+
+    Body: {"targets": {"regions": [...], "proxies": [...]},
+           "toxics": [{"type", "stream", "toxicity" (0-100), "attributes"}, ...],
+           "mode": "replace" (default: exactly this set) or "merge" (keep other toxics)}
+    """
+    body = await _body(request)
+    mode = body.get("mode", "replace")
+    if mode not in ("replace", "merge"):
+        raise HTTPException(400, "mode must be 'replace' or 'merge'")
     try:
-        conn = get_db_conn()
-        if not conn:
-            return {"error": "Cannot connect to cluster", "nodes": 0, "ranges": 0}
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT count(DISTINCT node_id) as node_count FROM crdb_internal.gossip_liveness WHERE decommissioning = false")
-            nodes = cur.fetchone()
-            
-            cur.execute("SELECT count(DISTINCT range_id) as range_count FROM crdb_internal.ranges_no_leases")
-            ranges = cur.fetchone()
-            
-            cur.execute("SELECT count(*) as replicas_count FROM crdb_internal.ranges_no_leases")
-            replicas = cur.fetchone()
-            
-        conn.close()
-        return {
-            "nodes": nodes['node_count'] if nodes else 0,
-            "ranges": ranges['range_count'] if ranges else 0,
-            "replicas": replicas['replicas_count'] if replicas else 0,
-            "timestamp": datetime.utcnow().isoformat()
+        toxics = parse_toxics(body.get("toxics"))
+    except ToxicError as e:
+        raise HTTPException(400, str(e))
+    targets = _toxic_targets(body.get("targets"))
+    
+    async def run():
+        result = await run_together([
+            _toxic_set_op(REGIONS[region], name, toxics, mode == "replace") for name, region in targets.items()
+        ])
+        for region in sorted(set(targets.values())):
+            _record_action("toxics", region, result, toxics=[t["name"] for t in toxics])
+        snapshot.request_refresh()
+        return {"ok": _outcome("toxics", result), "action": "toxics", "mode": mode, "proxies": list(targets), "toxics": toxics, **result}
+    
+    params = {"proxies": sorted(targets), "toxics": toxics, "mode": mode}
+    return await _admit(request, targets.values(), "toxics", params, run, response)
+
+@app.post("/api/toxics/clear")
+async def clear_toxics(request: Request, response: Response):
+    """Remove every toxic from the targeted proxies without changing whether they are enabled"""
+    targets = _toxic_targets((await _body(request)).get("targets"))
+    
+    async def run():
+        result = await run_together([_toxic_set_op(REGIONS[region], name, [], True) for name, region in targets.items()])
+        for region in sorted(set(targets.values())):
+            _record_action("clear-toxics", region, result)
+        snapshot.request_refresh()
+        return {"ok": _outcome("clear-toxics", result), "action": "clear-toxics", "proxies": list(targets), **result}
+    
+    return await _admit(request, targets.values(), "clear-toxics", {"proxies": sorted(targets)}, run, response)
+
+async def _evict_down_gateways():
+    """Evict pooled connections whose gateway region the shared snapshot reports as down"""
+    up = set(REGIONS)
+    while True:
+        await asyncio.sleep(0.5)
+        snap = snapshot.current()
+        if snap is None:
+            continue
+        now_up = {region for region, info in snap["data"]["status"].items() if info.get("up")}
+        for region in up - now_up:
+            db_pool.evict_gateway(region)
+        up = now_up
+
+SCENARIO_ACTIONS = {
+    "partition": lambda region: partition_region(region),
+    "recover": lambda region: recover_region(region),
+    "brownout": lambda region, ms=700: brownout_region(region, ms),
+    "kill": lambda region: kill_nodes(region)
+}
+
+scenarios = ScenarioRunner(SCENARIO_ACTIONS, REGIONS)
+
+@app.post("/api/scenarios/run")
+async def run_scenario(request: Request):
+    """Start a timed fault timeline (JSON or YAML body); only one runs at a time"""
+    try:
+        scenario = scenarios.parse((await request.body()).decode())
+    except ScenarioError as e:
+        raise HTTPException(400, str(e))
+    try:
+        run = scenarios.start(scenario)
+    except ScenarioBusy as e:
+        raise HTTPException(409, str(e))
+    timeline.event("scenario_start", name=run["name"], run_id=run["id"])
+    return run
+
+@app.get("/api/scenarios/status")
+def scenario_status():
+    """Latest scenario run with scheduled vs actual offsets per step"""
+    status = scenarios.status()
+    if status is None:
+        raise HTTPException(404, "No scenario has run yet")
+    return status
+
+def _scenario_control(**flags):
+    if scenarios.control(**flags) is None:
+        raise HTTPException(409, "No scenario is running")
+    return {"ok": True, **flags}
+
+@app.post("/api/scenarios/pause")
+def pause_scenario():
+    return _scenario_control(paused=True)
+
+@app.post("/api/scenarios/resume")
+def resume_scenario():
+    return _scenario_control(paused=False)
+
+@app.post("/api/scenarios/abort")
+def abort_scenario():
+    """Stop scheduling further steps; steps already running finish"""
+    return _scenario_control(abort=True)
+
+@app.get("/api/ttr")
+def ttr_history(limit: int = 20):
+    """Recent fault recovery measurements, newest first"""
+    return {"baseline_ms": ttr.baseline(), "measurements": ttr.history(limit=max(1, limit))}
+
+@app.get("/api/ttr/{measurement_id}")
+def ttr_measurement(measurement_id: str):
+    """Unavailability window, time to first write and time back to baseline for one fault"""
+    record = ttr.get(measurement_id)
+    if record is None:
+        raise HTTPException(404, "Unknown measurement")
+    return record
+
+@app.get("/api/node-latency")
+def node_latency():
+    """Per-node SELECT 1 / point read / write latency histograms measured through each node's Toxiproxy port"""
+    results = node_prober.results()
+    if results is None:
+        raise HTTPException(503, "No node probe results yet")
+    return results
+
+def _node_panel_state():
+    results = node_prober.results() or {}
+    return {
+        name: {
+            "region": node["region"],
+            "ok": node["ok"],
+            **{op: {"p50": h["p50"], "p99": h["p99"]} for op, h in node["ops"].items()}
         }
-    except Exception as e:
-        return {"error": str(e), "nodes": 0, "ranges": 0}
+        for name, node in results.get("nodes", {}).items()
+    }
+
+@app.get("/metrics")
+def get_metrics(request: Request):
+    """Prometheus/OpenMetrics scrape merged over every worker: route, Toxiproxy, Docker and SQL latency, pool and writes"""
+    try:
+        body, content_type = metrics.render(request.headers.get("accept"), transactions)
+    except RuntimeError as e:
+        raise HTTPException(501, str(e))
+    return Response(body, media_type=content_type)
+
+@app.get("/api/db-pool")
+def get_db_pool_stats():
+    """Connection pool hit/miss, wait-time and eviction counters for this worker"""
+    return db_pool.stats()
+
+@app.get("/api/admission")
+def get_admission_stats():
+    """This worker's admission counters (admitted, coalesced, rejected) and queued actions per region"""
+    return admission.snapshot()
+
+@app.get("/api/reconciler")
+def get_reconciler_stats():
+    """Toxiproxy reconcile counters for this worker (calls made, no-op applies, stale cache fixes)"""
+    return reconciler.stats
+
+def _query_cluster_health():
+    return cluster_health_query.query()
+
+@app.get("/api/cluster-health")
+async def cluster_health(response: Response, max_staleness_ms: int = None):
+    snap = await snapshot.get(_staleness(max_staleness_ms))
+    _set_snapshot_headers(response, snap)
+    meta = _snapshot_meta(snap)
+    return {**snap["data"]["cluster_health"], "snapshot_version": meta["version"], "snapshot_age_ms": meta["age_ms"]}
+
+ROW_ESTIMATE_TTL = 5.0
+_row_estimate = {"value": None, "fetched_at": float("-inf")}
+
+def _estimate_rows():
+    """Cheap row-count estimate from table statistics instead of SELECT count(*)"""
+    now = time.monotonic()
+    if now - _row_estimate["fetched_at"] > ROW_ESTIMATE_TTL:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT estimated_row_count FROM crdb_internal.table_row_statistics "
+                    "WHERE table_name = 'demo_transactions'"
+                )
+                row = cur.fetchone()
+        _row_estimate.update(value=row[0] if row else None, fetched_at=now)
+    return _row_estimate["value"]
 
 @app.get("/api/transactions")
-def get_transactions():
-    global transaction_count
-    return {"count": transaction_count, "timestamp": datetime.utcnow().isoformat()}
+async def get_transactions(estimate: bool = False):
+    count = transactions.total()
+    result = {
+        "count": count,
+        "rate_per_s": transactions.rate(1),
+        "rate_10s": transactions.rate(10),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    if estimate:
+        # Reconcile against the table: rows also come from demo scripts and other clients
+        try:
+            estimated = await asyncio.to_thread(_estimate_rows)
+            result["estimated_rows"] = estimated
+            result["drift"] = estimated - count if estimated is not None else None
+        except Exception as e:
+            result["estimate_error"] = str(e)
+    return result
+
+def _panel_state():
+    """Everything the chaos panel renders, minus fields that change on every collection"""
+    snap = snapshot.current()
+    if snap is None or snapshot_age(snap) > snapshot.max_age:
+        snapshot.request_refresh()
+    data = snap["data"] if snap else {"status": {}, "cluster_health": {}}
+    health = {k: v for k, v in data["cluster_health"].items() if k != "timestamp"}
+    return {
+        "status": data["status"],
+        "cluster_health": health,
+        "transactions": {"count": transactions.total(), "rate_per_s": transactions.rate(1)},
+        "nodes": _node_panel_state()
+    }
+
+@app.get("/api/stream")
+async def stream(request: Request):
+    """Server-Sent Events feed of the panel state: one snapshot event, then deltas"""
+    await snapshot.get()
+    return StreamingResponse(
+        event_stream(request, _panel_state),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/timeline")
+def get_timeline(since: float = None, until: float = None, format: str = "json"):
+    """Per-second throughput, write latency and region state plus chaos events (unix-second bounds)"""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Unknown format '{format}', expected one of: {', '.join(EXPORT_FORMATS)}")
+    if format == "json":
+        return timeline.query(since, until)
+    try:
+        body, media_type = timeline.export(format, since, until)
+    except RuntimeError as e:
+        raise HTTPException(501, str(e))
+    filename = f"timeline-{int(time.time())}.{format}"
+    return Response(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def _write_batch(writer, rows):
+    with db_pool.connection() as conn:
+        writer(conn, random_amounts(rows))
 
 @app.post("/api/simulate-writes")
-async def simulate_writes(count: int = 10):
-    global transaction_count
+async def simulate_writes(count: int = 10, mode: str = "single", batch_size: int = 100, concurrency: int = 1):
+    """Generate write load; modes: single, batch (multi-row INSERT), prepared, copy"""
+    if mode not in WRITERS:
+        raise HTTPException(400, f"Unknown mode '{mode}', expected one of: {', '.join(WRITERS)}")
+    count = max(0, min(count, SIMULATE_WRITES_MAX_ROWS))
+    batch_size = 1 if mode == "single" else max(1, min(batch_size, 10000))
+    concurrency = max(1, min(concurrency, db_pool.max_size))
+    writer = WRITERS[mode]
+    batches = iter([min(batch_size, count - i) for i in range(0, count, batch_size)])
+    latencies = []
     success = 0
     failed = 0
     
-    for i in range(count):
-        try:
-            conn = get_db_conn()
-            if conn:
-                with conn.cursor() as cur:
-                    cur.execute(f"INSERT INTO defaultdb.demo_transactions (ts, amount) VALUES (now(), {random.randint(1, 1000)}) ON CONFLICT DO NOTHING")
-                conn.commit()
-                conn.close()
-                success += 1
-                transaction_count += 1
-            else:
-                failed += 1
-        except Exception as e:
-            failed += 1
-        await asyncio.sleep(0.01)
+    async def worker():
+        nonlocal success, failed
+        # All workers pull from the same iterator, so each batch is written exactly once
+        for rows in batches:
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(_write_batch, writer, rows)
+                success += rows
+                transactions.increment(rows)
+            except Exception:
+                failed += rows
+            latencies.append((time.perf_counter() - started) * 1000)
+            write_latency.record(latencies[-1])
+            if mode == "single":
+                await asyncio.sleep(0.01)
     
-    return {"success": success, "failed": failed, "total_count": transaction_count}
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    return {
+        "success": success,
+        "failed": failed,
+        "total_count": transactions.total(),
+        "mode": mode,
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(success / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0
+        }
+    }
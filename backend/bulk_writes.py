@@ -0,0 +1,71 @@
+"""Insert strategies used by /api/simulate-writes, from one row per statement to COPY"""
+import io
+import random
+
+from psycopg2.extras import execute_values
+
+TABLE = "defaultdb.demo_transactions"
+
+
+def random_amounts(n):
+    return [random.randint(1, 1000) for _ in range(n)]
+
+
+def insert_single(conn, amounts):
+    """One parameterized INSERT and commit per row"""
+    with conn.cursor() as cur:
+        for amount in amounts:
+            cur.execute(f"INSERT INTO {TABLE} (ts, amount) VALUES (now(), %s) ON CONFLICT DO NOTHING", (amount,))
+            conn.commit()
+
+
+def insert_batch(conn, amounts):
+    """A single multi-row parameterized INSERT"""
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"INSERT INTO {TABLE} (ts, amount) VALUES %s ON CONFLICT DO NOTHING",
+            [(a,) for a in amounts],
+            template="(now(), %s)",
+            page_size=len(amounts),
+        )
+    conn.commit()
+
+
+def insert_prepared(conn, amounts):
+    """Server-side prepared statement taking the whole batch as one INT[] parameter"""
+    prepared = getattr(conn, "prepared_statements", None)
+    if prepared is None:
+        prepared = conn.prepared_statements = set()
+    with conn.cursor() as cur:
+        if "demo_insert_batch" not in prepared:
+            cur.execute(
+                f"PREPARE demo_insert_batch (INT[]) AS "
+                f"INSERT INTO {TABLE} (ts, amount) SELECT now(), unnest($1) ON CONFLICT DO NOTHING"
+            )
+            prepared.add("demo_insert_batch")
+        cur.execute("EXECUTE demo_insert_batch (%s)", (list(amounts),))
+    conn.commit()
+
+
+def insert_copy(conn, amounts):
+    """COPY ... FROM STDIN; ts falls back to its now() default"""
+    buf = io.StringIO("".join(f"{a}\n" for a in amounts))
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {TABLE} (amount) FROM STDIN", buf)
+    conn.commit()
+
+
+WRITERS = {
+    "single": insert_single,
+    "batch": insert_batch,
+    "prepared": insert_prepared,
+    "copy": insert_copy,
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = int(len(sorted_values) * pct / 100)
+    return sorted_values[min(index, len(sorted_values) - 1)]
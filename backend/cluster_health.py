@@ -0,0 +1,76 @@
+"""Node, range and replica counts for the panel without rescanning every range descriptor each second.
+
+Counting ranges and replicas means scanning ``crdb_internal.ranges_no_leases``,
+which reads every range descriptor in meta2. Each store's range count is
+already gossiped, though, and ``crdb_internal.gossip_nodes`` serves it from
+the gateway's memory. That per-node count works as a generation: the
+descriptor scan only runs again when it changes, or once the cached counts
+are older than ``CLUSTER_HEALTH_MAX_CACHE``. Both paths are a single
+statement.
+"""
+import os
+import time
+from datetime import datetime
+
+CLUSTER_HEALTH_MAX_CACHE = float(os.getenv("CLUSTER_HEALTH_MAX_CACHE", "30"))
+
+_NODES_AND_GENERATION = """
+    (SELECT count(DISTINCT node_id) FROM crdb_internal.gossip_liveness WHERE decommissioning = false) AS nodes,
+    (SELECT string_agg(node_id::STRING || ':' || ranges::STRING, ',' ORDER BY node_id)
+       FROM crdb_internal.gossip_nodes) AS generation
+"""
+
+CHEAP_QUERY = f"SELECT {_NODES_AND_GENERATION}"
+
+FULL_QUERY = f"""
+SELECT {_NODES_AND_GENERATION},
+    count(*) AS ranges,
+    coalesce(sum(array_length(replicas, 1)), 0) AS replicas
+FROM crdb_internal.ranges_no_leases
+"""
+
+
+class ClusterHealth:
+    def __init__(self, pool, max_cache=CLUSTER_HEALTH_MAX_CACHE):
+        self.pool = pool
+        self.max_cache = max_cache
+        self._generation = None
+        self._ranges = None
+        self._refreshed = float("-inf")
+        self._refreshed_at = None
+        self.stats = {"cheap_queries": 0, "full_queries": 0}
+
+    def query(self):
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            return {"error": "Cannot connect to cluster", "nodes": 0, "ranges": 0}
+        try:
+            with conn.cursor() as cur:
+                full = self._ranges is None or time.monotonic() - self._refreshed > self.max_cache
+                if not full:
+                    cur.execute(CHEAP_QUERY)
+                    self.stats["cheap_queries"] += 1
+                    nodes, generation = cur.fetchone()
+                    # Gossiped range counts moved: the descriptor set changed, rescan it
+                    full = generation != self._generation
+                if full:
+                    cur.execute(FULL_QUERY)
+                    self.stats["full_queries"] += 1
+                    nodes, generation, ranges, replicas = cur.fetchone()
+                    self._generation = generation
+                    self._ranges = (ranges, replicas)
+                    self._refreshed = time.monotonic()
+                    self._refreshed_at = datetime.utcnow().isoformat()
+            ranges, replicas = self._ranges
+            return {
+                "nodes": nodes or 0,
+                "ranges": ranges or 0,
+                "replicas": replicas or 0,
+                "ranges_refreshed_at": self._refreshed_at,
+                "timestamp": datetime.utcnow().isoformat()
+            }
+        except Exception as e:
+            return {"error": str(e), "nodes": 0, "ranges": 0}
+        finally:
+            self.pool.putconn(conn)
@@ -0,0 +1,246 @@
+"""Per-worker psycopg2 connection pool with checkout validation and gateway eviction.
+
+Connections go through HAProxy, so each one lands on some gateway node. The
+pool records that node's region when the connection is opened so a region
+that is killed or partitioned can be evicted in one call instead of every
+request discovering a dead socket on its own.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "60"))
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "5"))
+# Idle connections older than this are pinged with SELECT 1 on checkout; cheaper
+# checks (closed flag, transaction status) always run
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "1.0"))
+# Connections each worker opens right after it is forked
+DB_POOL_MIN_IDLE = int(os.getenv("DB_POOL_MIN_IDLE", "2"))
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection became free within the pool's wait timeout"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that can carry pool bookkeeping attributes"""
+
+
+class ConnectionPool:
+    def __init__(self, connect_kwargs, max_size=DB_POOL_MAX_SIZE, idle_timeout=DB_POOL_IDLE_TIMEOUT,
+                 wait_timeout=DB_POOL_WAIT_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._checked_out = 0
+        self._evicted_at = {}
+        self._stats = {
+            "hits": 0, "misses": 0, "waits": 0, "wait_time_total_ms": 0.0, "wait_time_max_ms": 0.0,
+            "timeouts": 0, "created": 0, "closed": 0, "validation_failures": 0,
+            "evicted_idle": 0, "evicted_gateway": 0, "connect_failures": 0,
+        }
+
+    def _check_fork(self):
+        # Connections inherited from the gunicorn master belong to it; forget, don't close
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(connection_factory=PooledConnection, cursor_factory=metrics.TimedCursor,
+                                    **self.connect_kwargs)
+        except Exception:
+            with self._cond:
+                self._stats["connect_failures"] += 1
+            raise
+        conn.created_at = conn.last_used = time.monotonic()
+        conn.gateway_node = conn.gateway_region = None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT crdb_internal.node_id(), crdb_internal.locality_value('region')")
+                conn.gateway_node, conn.gateway_region = cur.fetchone()
+        except Exception:
+            pass
+        finally:
+            conn.rollback()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _publish(self, wait_seconds=None, timed_out=False):
+        """Update the Prometheus pool gauges (call with self._cond held)"""
+        metrics.observe_pool(self._checked_out, len(self._idle), self.max_size, wait_seconds, timed_out)
+
+    def _is_stale(self, conn, now):
+        if conn.closed:
+            return "validation_failures"
+        if now - conn.last_used > self.idle_timeout:
+            return "evicted_idle"
+        if conn.created_at <= self._evicted_at.get(conn.gateway_region, float("-inf")):
+            return "evicted_gateway"
+        return None
+
+    def _close(self, conn, reason=None):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["closed"] += 1
+            if reason:
+                self._stats[reason] += 1
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def prewarm(self, n=DB_POOL_MIN_IDLE):
+        """Open connections until ``n`` are idle; returns how many were opened"""
+        with self._cond:
+            self._check_fork()
+            missing = min(n, self.max_size - self._checked_out) - len(self._idle)
+            # Reserve the slots so concurrent checkouts cannot overfill the pool
+            missing = max(0, missing)
+            self._checked_out += missing
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._checked_out -= missing
+                self._idle.extend(opened)
+                self._publish()
+                self._cond.notify(len(opened))
+        return len(opened)
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+        conn = None
+        stale = []
+        with self._cond:
+            self._check_fork()
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    candidate = self._idle.pop()
+                    reason = self._is_stale(candidate, now)
+                    if reason:
+                        stale.append((candidate, reason))
+                        continue
+                    conn = candidate
+                    break
+                if conn is not None or self._checked_out + len(self._idle) < self.max_size:
+                    self._checked_out += 1
+                    break
+                remaining = self.wait_timeout - (now - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    self._publish(timed_out=True)
+                    raise PoolExhausted(f"No database connection free within {self.wait_timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+            if waited:
+                wait_ms = (time.monotonic() - started) * 1000
+                self._stats["waits"] += 1
+                self._stats["wait_time_total_ms"] += wait_ms
+                self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], wait_ms)
+            self._publish((time.monotonic() - started) if waited else None)
+        for candidate, reason in stale:
+            self._close(candidate, reason)
+
+        try:
+            if conn is not None:
+                healthy = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                if healthy and time.monotonic() - conn.last_used > self.ping_after:
+                    healthy = self._ping(conn)
+                if healthy:
+                    with self._cond:
+                        self._stats["hits"] += 1
+                    return conn
+                self._close(conn, "validation_failures")
+            with self._cond:
+                self._stats["misses"] += 1
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._checked_out -= 1
+                self._publish()
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn):
+        reason = None
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                reason = "validation_failures"
+        conn.last_used = time.monotonic()
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._checked_out -= 1
+            if reason is None:
+                reason = self._is_stale(conn, conn.last_used)
+            if reason is None:
+                self._idle.append(conn)
+            self._publish()
+            self._cond.notify()
+        if reason is not None:
+            self._close(conn, reason)
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def evict_gateway(self, region):
+        """Drop every connection whose gateway node is in ``region``, including ones in use"""
+        with self._cond:
+            self._check_fork()
+            self._evicted_at[region] = time.monotonic()
+            keep = [c for c in self._idle if c.gateway_region != region]
+            dropped = [c for c in self._idle if c.gateway_region == region]
+            self._idle = keep
+        for conn in dropped:
+            self._close(conn, "evicted_gateway")
+        return len(dropped)
+
+    def stats(self):
+        with self._cond:
+            self._check_fork()
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "pid": self._pid,
+                "max_size": self.max_size,
+                "in_use": self._checked_out,
+                "idle": len(self._idle),
+                "hit_ratio": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                "wait_time_avg_ms": round(self._stats["wait_time_total_ms"] / self._stats["waits"], 2) if self._stats["waits"] else 0.0,
+            }
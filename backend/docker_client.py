@@ -0,0 +1,112 @@
+"""Async Docker Engine API client speaking HTTP over the daemon's Unix socket"""
+import json
+import os
+
+import httpx
+
+import metrics
+
+DOCKER_SOCKET_PATH = os.getenv("DOCKER_SOCKET_PATH", "/var/run/docker.sock")
+DOCKER_TIMEOUT = float(os.getenv("DOCKER_TIMEOUT", "5"))
+
+
+class DockerError(Exception):
+    """Raised when the Docker Engine API answers with an error status"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Docker API error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class DockerClient:
+    """Pooled Engine API client; works against any socket speaking the Docker API.
+
+    Podman's compatibility socket is supported as well, and tests can point
+    ``socket_path`` at a local fake server. Like ``ToxiproxyClient`` the
+    connection pool is created lazily inside the worker process.
+    """
+
+    def __init__(self, socket_path=DOCKER_SOCKET_PATH, timeout=DOCKER_TIMEOUT, max_connections=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30,
+        )
+        self._client = None
+        self._pid = None
+
+    def _http(self):
+        if self._client is None or self._client.is_closed or self._pid != os.getpid():
+            transport = httpx.AsyncHTTPTransport(uds=self.socket_path, limits=self._limits)
+            # The host part is ignored by the daemon; it only has to be a valid URL
+            self._client = httpx.AsyncClient(transport=transport, base_url="http://docker", timeout=self.timeout)
+            self._pid = os.getpid()
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._pid == os.getpid():
+            await self._client.aclose()
+        self._client = None
+
+    async def _request(self, method, path, ok=(200, 201, 204), timeout=None, **kwargs):
+        with metrics.docker_call(method, path):
+            r = await self._http().request(method, path, timeout=timeout or self.timeout, **kwargs)
+        if r.status_code not in ok:
+            try:
+                message = r.json().get("message", r.text)
+            except ValueError:
+                message = r.text
+            raise DockerError(r.status_code, message)
+        return r
+
+    async def ping(self):
+        r = await self._request("GET", "/_ping")
+        return r.text == "OK"
+
+    async def list_containers(self, all=True):
+        r = await self._request("GET", "/containers/json", params={"all": "1" if all else "0"})
+        return r.json()
+
+    async def container_states(self):
+        """Map every container name to its state ("running", "exited", ...) in one call"""
+        states = {}
+        for c in await self.list_containers(all=True):
+            for name in c.get("Names", []):
+                states[name.lstrip("/")] = c.get("State")
+        return states
+
+    async def inspect_container(self, container):
+        r = await self._request("GET", f"/containers/{container}/json")
+        return r.json()
+
+    async def kill(self, container, signal="SIGKILL", timeout=10):
+        await self._request("POST", f"/containers/{container}/kill", params={"signal": signal}, timeout=timeout)
+
+    async def start(self, container, timeout=10):
+        # 304 means the container was already running
+        r = await self._request("POST", f"/containers/{container}/start", ok=(204, 304), timeout=timeout)
+        return r.status_code == 204
+
+    async def events(self, filters=None):
+        """Stream decoded events from /events until the daemon closes the connection"""
+        params = {"filters": json.dumps(filters)} if filters else None
+        async with self._http().stream("GET", "/events", params=params, timeout=httpx.Timeout(self.timeout, read=None)) as r:
+            if r.status_code != 200:
+                raise DockerError(r.status_code, (await r.aread()).decode(errors="replace"))
+            async for line in r.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    async def list_networks(self, name=None):
+        params = {"filters": json.dumps({"name": [name]})} if name else None
+        r = await self._request("GET", "/networks", params=params)
+        return r.json()
+
+    async def network_connect(self, network, container):
+        await self._request("POST", f"/networks/{network}/connect", json={"Container": container})
+
+    async def network_disconnect(self, network, container, force=False):
+        await self._request("POST", f"/networks/{network}/disconnect", json={"Container": container, "Force": force})
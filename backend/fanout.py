@@ -0,0 +1,69 @@
+"""Apply a set of fault operations concurrently, released together through a barrier"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+
+class Op:
+    """One operation against one target (a container or a proxy).
+
+    ``run`` is an async callable taking a ``mark`` function. It calls ``mark()`` as
+    soon as the fault is in effect, e.g. right after a proxy is disabled and before
+    its toxics are cleaned up. If it never calls ``mark``, completion counts as
+    the effective time. A non-None return value is reported as ``result``.
+    """
+
+    def __init__(self, target, kind, action, run):
+        self.target = target
+        self.kind = kind
+        self.action = action
+        self.run = run
+
+
+async def run_together(ops):
+    """Run every op at once and report when each one became effective.
+
+    All ops are created first and wait on a barrier, so no operation starts
+    until every other one is ready to start too.
+    """
+    if not ops:
+        return {"released_at": None, "spread_ms": 0.0, "timings": []}
+    barrier = asyncio.Barrier(len(ops) + 1)
+    released = {}
+
+    async def one(op):
+        effective = []
+        await barrier.wait()
+        value = None
+        try:
+            value = await op.run(lambda: effective.append(time.perf_counter()))
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+        done = time.perf_counter()
+        at = effective[0] if effective else done
+        timing = {
+            "target": op.target,
+            "kind": op.kind,
+            "action": op.action,
+            "ok": ok,
+            "error": error,
+            "effective_ms": round((at - released["perf"]) * 1000, 2),
+            "completed_ms": round((done - released["perf"]) * 1000, 2),
+            "effective_at": datetime.fromtimestamp(released["wall"] + (at - released["perf"]), timezone.utc).isoformat(),
+        }
+        if value is not None:
+            timing["result"] = value
+        return timing
+
+    tasks = [asyncio.create_task(one(op)) for op in ops]
+    # Give every task the chance to reach the barrier, then let them all go
+    released["perf"], released["wall"] = time.perf_counter(), time.time()
+    await barrier.wait()
+    timings = await asyncio.gather(*tasks)
+    effective = [t["effective_ms"] for t in timings if t["ok"]]
+    return {
+        "released_at": datetime.fromtimestamp(released["wall"], timezone.utc).isoformat(),
+        "spread_ms": round(max(effective) - min(effective), 2) if effective else 0.0,
+        "timings": timings,
+    }
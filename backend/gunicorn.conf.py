@@ -24,9 +24,27 @@ proc_name = "cockroach-chaos-demo"
 # Worker lifecycle
 max_requests = 1000  # Restart workers after 1000 requests (prevent memory leaks)
 max_requests_jitter = 50
+# Stopping workers finish in-flight chaos actions (admission queue + WORKER_DRAIN_TIMEOUT) before being killed
+graceful_timeout = 110
 
 # Preload app for faster worker startup
 preload_app = True
 
+# Shared per-worker files: clean Prometheus metrics per server run, forget exited workers
+def on_starting(server):
+    import metrics
+    metrics.reset()
+
+def child_exit(server, worker):
+    import lifecycle
+    import metrics
+    metrics.worker_exited(worker.pid)
+    lifecycle.retire(worker.pid)
+
+# Each (re)forked worker opens its own DB connections; the rest is warmed before it serves
+def post_fork(server, worker):
+    import app
+    app.warm_after_fork()
+
 print(f"🚀 Starting Gunicorn with {workers} workers for multi-user support")
 print(f"   Estimated capacity: {workers * 2}-{workers * 5} concurrent users")
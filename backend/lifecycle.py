@@ -0,0 +1,133 @@
+"""Worker warm-up, readiness and draining for gunicorn workers.
+
+With ``preload_app`` every worker is forked from the master and shares none
+of its sockets. A worker recycled after ``max_requests`` would otherwise pay
+for DNS lookups, new Toxiproxy/Docker/SQL connections and network discovery
+on its first requests.
+
+gunicorn's ``post_fork`` hook marks the new worker as warming, and the app
+opens its database connections there. The lifespan startup then runs every
+warm-up step concurrently, before uvicorn starts accepting connections on
+the worker, so no request lands on a cold worker. Steps that fail are
+retried in the background, and ``/readyz`` reports the worker as degraded
+until they succeed.
+
+Each worker's state is published to a shared file, so any worker can list
+all of them. On shutdown a worker first drains: chaos work in flight is
+given ``WORKER_DRAIN_TIMEOUT`` to finish before anything is cancelled.
+"""
+import asyncio
+import os
+import time
+
+import shared_state
+
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+WARMUP_RETRY = float(os.getenv("WARMUP_RETRY", "5"))
+# gunicorn kills a worker that has not checked in for `timeout` (120 s), and a
+# recycling worker stops checking in once it stops accepting: leave room for
+# requests still queued for admission
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "45"))
+
+WORKERS_FILE = "workers.json"
+WORKERS_LOCK = "workers.lock"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def retire(pid):
+    """Forget an exited worker (gunicorn ``child_exit``)"""
+    with shared_state.FileLock(WORKERS_LOCK):
+        workers = shared_state.read_json(WORKERS_FILE, {})
+        if workers.pop(str(pid), None) is not None:
+            shared_state.write_json(WORKERS_FILE, workers)
+
+
+class WorkerLifecycle:
+    def __init__(self, steps):
+        """``steps`` maps a name to an async callable warming one resource; it raises if it could not"""
+        self.steps = steps
+        self.state = "starting"
+        self.results = {name: {"ok": None, "ms": None, "error": None} for name in steps}
+        self.forked_at = None
+        self.ready_at = None
+
+    def post_fork(self):
+        self.state = "warming"
+        self.forked_at = time.time()
+        self._publish()
+
+    def ready(self):
+        return self.state == "ready"
+
+    async def _step(self, name):
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.steps[name](), WARMUP_TIMEOUT)
+            self.results[name] = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 2), "error": None}
+        except Exception as e:
+            self.results[name] = {
+                "ok": False, "ms": round((time.perf_counter() - started) * 1000, 2),
+                "error": " ".join(str(e).split()) or type(e).__name__,
+            }
+
+    def _settle(self):
+        if self.state == "draining":
+            return
+        if all(r["ok"] for r in self.results.values()):
+            self.state = "ready"
+            self.ready_at = time.time()
+        else:
+            self.state = "degraded"
+        self._publish()
+
+    async def warm(self):
+        """Run every step at once; awaited in the lifespan startup, before the worker serves"""
+        if self.forked_at is None:
+            self.forked_at = time.time()
+        self.state = "warming"
+        await asyncio.gather(*(self._step(name) for name in self.steps))
+        self._settle()
+
+    async def run(self):
+        """Background loop: retry failed steps until every one has succeeded"""
+        while self.state == "degraded":
+            await asyncio.sleep(WARMUP_RETRY)
+            await asyncio.gather(*(self._step(name) for name, r in self.results.items() if not r["ok"]))
+            self._settle()
+
+    async def drain(self, *waits):
+        """Mark the worker draining and give ``waits`` (async fn(timeout)) the drain budget between them"""
+        self.state = "draining"
+        self._publish()
+        deadline = time.monotonic() + WORKER_DRAIN_TIMEOUT
+        for wait in waits:
+            await wait(max(0.0, deadline - time.monotonic()))
+
+    def snapshot(self):
+        return {
+            "pid": os.getpid(),
+            "state": self.state,
+            "warm_ms": round((self.ready_at - self.forked_at) * 1000, 2) if self.ready_at and self.forked_at else None,
+            "steps": self.results,
+        }
+
+    def _publish(self):
+        with shared_state.FileLock(WORKERS_LOCK):
+            workers = shared_state.read_json(WORKERS_FILE, {})
+            workers = {pid: w for pid, w in workers.items() if _alive(int(pid))}
+            workers[str(os.getpid())] = {"state": self.state, "since": time.time()}
+            shared_state.write_json(WORKERS_FILE, workers)
+
+    def workers(self):
+        """State of every live worker, as each last published it"""
+        workers = shared_state.read_json(WORKERS_FILE, {})
+        return {pid: w for pid, w in workers.items() if _alive(int(pid))}
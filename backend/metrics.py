@@ -0,0 +1,216 @@
+"""Prometheus metrics for routes, Toxiproxy calls, Docker operations and SQL statements.
+
+Every gunicorn worker records into its own files under
+``PROMETHEUS_MULTIPROC_DIR``, using prometheus_client's multiprocess mode.
+``/metrics`` merges all workers' files at scrape time, so any worker can
+answer a scrape. prometheus_client reads the directory when it is imported,
+which is why this module sets the directory first. The gunicorn hooks wipe it
+on startup and retire the gauges of exited workers.
+
+prometheus_client is optional. Without it, recording is a no-op and
+``render`` raises RuntimeError.
+"""
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+import shared_state
+
+MULTIPROC_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", shared_state.path("prometheus"))
+os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+try:
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+    from prometheus_client import exposition, multiprocess
+    from prometheus_client.core import CounterMetricFamily
+    from prometheus_client.openmetrics import exposition as openmetrics
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+# Seconds; from sub-millisecond SQL/Toxiproxy calls up to the gunicorn timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|COPY)\s+([\w.]+)", re.I)
+# The collection endpoints (/containers/json, /networks/create, ...) are not ids
+_DOCKER_ID = re.compile(r"^/(containers|networks)/(?!(?:json|create|prune)$)[^/]+")
+
+if PROMETHEUS_AVAILABLE:
+    HTTP_LATENCY = Histogram(
+        "chaos_http_request_duration_seconds", "Time to respond to an API request, by route template",
+        ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+    )
+    TOXIPROXY_LATENCY = Histogram(
+        "chaos_toxiproxy_request_duration_seconds", "Toxiproxy REST calls by API and client operation",
+        ["api", "op", "outcome"], buckets=LATENCY_BUCKETS,
+    )
+    DOCKER_LATENCY = Histogram(
+        "chaos_docker_request_duration_seconds", "Docker Engine API calls by method and path template",
+        ["method", "path", "outcome"], buckets=LATENCY_BUCKETS,
+    )
+    SQL_LATENCY = Histogram(
+        "chaos_sql_statement_duration_seconds", "SQL statements by verb and table",
+        ["statement", "outcome"], buckets=LATENCY_BUCKETS,
+    )
+    POOL_WAIT = Histogram(
+        "chaos_db_pool_wait_seconds", "Time spent waiting for a free pooled connection", buckets=LATENCY_BUCKETS,
+    )
+    POOL_IN_USE = Gauge("chaos_db_pool_in_use", "Pooled connections checked out", multiprocess_mode="livesum")
+    POOL_IDLE = Gauge("chaos_db_pool_idle", "Pooled connections idle", multiprocess_mode="livesum")
+    POOL_MAX = Gauge("chaos_db_pool_max_size", "Pool capacity summed over workers", multiprocess_mode="livesum")
+    POOL_TIMEOUTS = Counter("chaos_db_pool_timeouts", "Checkouts that gave up waiting for a connection")
+else:
+    HTTP_LATENCY = TOXIPROXY_LATENCY = DOCKER_LATENCY = SQL_LATENCY = None
+
+
+def statement_label(sql):
+    """Low-cardinality label for a statement: its verb and first table, e.g. "INSERT defaultdb.chaos_probe" """
+    if isinstance(sql, bytes):
+        sql = sql[:500].decode(errors="replace")
+    else:
+        sql = str(sql)[:500]
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else "?"
+    match = _TABLE.search(sql)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+def docker_path(path):
+    """Docker API path with container/network names replaced, e.g. /containers/{id}/kill"""
+    return _DOCKER_ID.sub(r"/\1/{id}", path)
+
+
+@contextmanager
+def _timed(histogram, **labels):
+    if histogram is None:
+        yield
+        return
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.perf_counter() - started)
+
+
+def toxiproxy_call(api, op):
+    return _timed(TOXIPROXY_LATENCY, api=api, op=op)
+
+
+def docker_call(method, path):
+    return _timed(DOCKER_LATENCY, method=method, path=docker_path(path))
+
+
+def sql_statement(sql):
+    return _timed(SQL_LATENCY, statement=statement_label(sql))
+
+
+def observe_sql(sql, seconds, ok=True):
+    """Record a statement timed by the caller (async psycopg2 connections)"""
+    if PROMETHEUS_AVAILABLE:
+        SQL_LATENCY.labels(statement=statement_label(sql), outcome="ok" if ok else "error").observe(seconds)
+
+
+def observe_request(method, route, status, seconds):
+    if PROMETHEUS_AVAILABLE:
+        HTTP_LATENCY.labels(method=method, route=route, status=str(status)).observe(seconds)
+
+
+def observe_pool(in_use, idle, max_size, wait_seconds=None, timed_out=False):
+    if not PROMETHEUS_AVAILABLE:
+        return
+    POOL_IN_USE.set(in_use)
+    POOL_IDLE.set(idle)
+    POOL_MAX.set(max_size)
+    if wait_seconds is not None:
+        POOL_WAIT.observe(wait_seconds)
+    if timed_out:
+        POOL_TIMEOUTS.inc()
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing each HTTP request until its response starts, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        responded = False
+
+        def observe(status):
+            # The router stores the matched route in the scope; templates keep label cardinality fixed
+            route = getattr(scope.get("route"), "path", "unmatched")
+            observe_request(scope["method"], route, status, time.perf_counter() - started)
+
+        async def send_timed(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        except Exception:
+            if not responded:
+                observe(500)
+            raise
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that records every execute/executemany/copy into the SQL histogram"""
+
+    def execute(self, sql, args=None):
+        with sql_statement(sql):
+            return super().execute(sql, args)
+
+    def executemany(self, sql, args_list):
+        with sql_statement(sql):
+            return super().executemany(sql, args_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with sql_statement(sql):
+            return super().copy_expert(sql, file, size)
+
+
+class _WritesCollector:
+    """The shared write counter, read at scrape time (it is already merged over workers)"""
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def collect(self):
+        yield CounterMetricFamily("chaos_writes", "Rows written by /api/simulate-writes", value=self.counter.total())
+
+
+def render(accept, writes=None):
+    """(body, content type) for a scrape, in OpenMetrics when the scraper asks for it"""
+    if not PROMETHEUS_AVAILABLE:
+        raise RuntimeError("prometheus_client is not installed; pip install prometheus_client")
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    if writes is not None:
+        registry.register(_WritesCollector(writes))
+    if "application/openmetrics-text" in (accept or ""):
+        return openmetrics.generate_latest(registry), openmetrics.CONTENT_TYPE_LATEST
+    return exposition.generate_latest(registry), exposition.CONTENT_TYPE_LATEST
+
+
+def reset():
+    """Drop files left by a previous server run (gunicorn ``on_starting``)"""
+    shutil.rmtree(MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+
+def worker_exited(pid):
+    """Stop counting an exited worker's live gauges (gunicorn ``child_exit``)"""
+    if PROMETHEUS_AVAILABLE:
+        multiprocess.mark_process_dead(pid, MULTIPROC_DIR)
@@ -0,0 +1,97 @@
+"""Docker network name and container attachments, resolved once and kept fresh by Docker events"""
+import asyncio
+
+from docker_client import DockerError
+
+NETWORK_PATTERNS = ("cockroach-chaos-demo_default", "default")
+DEFAULT_NETWORK = "cockroach-chaos-demo_default"
+# Container whose attachments reveal the network when no name pattern matches
+PROBE_CONTAINER = "crdb-e1a"
+
+
+class NetworkCache:
+    def __init__(self, docker, patterns=NETWORK_PATTERNS, default=DEFAULT_NETWORK):
+        self.docker = docker
+        self.patterns = patterns
+        self.default = default
+        self.network = None
+        self.attachments = {}
+        self.resolutions = 0
+        self._resolving = None
+
+    async def _lookup(self):
+        containers = await self.docker.list_containers(all=True)
+        attachments = {}
+        for c in containers:
+            networks = set(c.get("NetworkSettings", {}).get("Networks", {}) or {})
+            for name in c.get("Names", []):
+                attachments[name.lstrip("/")] = networks
+
+        network = None
+        # Try common network name patterns
+        for pattern in self.patterns:
+            found = await self.docker.list_networks(name=pattern)
+            if found:
+                network = found[0]["Name"]
+                break
+        # Fallback: whatever network one of our containers is attached to
+        if network is None and attachments.get(PROBE_CONTAINER):
+            network = sorted(attachments[PROBE_CONTAINER])[0]
+        self.resolutions += 1
+        return network or self.default, attachments
+
+    async def resolve(self, force=False):
+        """Cached network name; concurrent callers share a single lookup"""
+        if self.network is not None and not force:
+            return self.network
+        if self._resolving is None:
+            self._resolving = asyncio.ensure_future(self._lookup())
+        task = self._resolving
+        try:
+            self.network, self.attachments = await asyncio.shield(task)
+        except Exception:
+            if self.network is None:
+                self.network = self.default
+        finally:
+            if self._resolving is task:
+                self._resolving = None
+        return self.network
+
+    def invalidate(self):
+        self.network = None
+
+    def is_attached(self, container):
+        """True/False from the cache, or None when the container is unknown"""
+        networks = self.attachments.get(container)
+        return None if networks is None else self.network in networks
+
+    def mark(self, container, attached):
+        networks = self.attachments.setdefault(container, set())
+        if attached:
+            networks.add(self.network)
+        else:
+            networks.discard(self.network)
+
+    async def run_op(self, op, container):
+        """Run a connect/disconnect, re-resolving once if the cached network went stale"""
+        network = await self.resolve()
+        try:
+            await op(network, container)
+        except DockerError as e:
+            if e.status_code != 404 or "network" not in e.message.lower():
+                raise
+            network = await self.resolve(force=True)
+            await op(network, container)
+
+    async def watch(self, retry_delay=5.0):
+        """Refresh on network create/destroy/connect/disconnect events; reconnects if the stream drops"""
+        while True:
+            try:
+                await self.resolve(force=True)
+                async for _ in self.docker.events(filters={"type": ["network"]}):
+                    await self.resolve(force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            await asyncio.sleep(retry_delay)
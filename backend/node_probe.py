@@ -0,0 +1,205 @@
+"""Per-node latency probes that go straight to each node's Toxiproxy listener, bypassing HAProxy.
+
+One worker (elected by flock) keeps one persistent connection per node. It
+opens it with psycopg2's asynchronous mode, which the event loop drives
+through add_reader/add_writer, so no threads are involved. On every tick it
+times ``SELECT 1``, a point read and a small write. The results go into
+rolling log-bucketed histograms (the buckets from ``shared_latency``), which
+are published to a shared JSON file for the panel and the API.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+import metrics
+import shared_state
+from shared_latency import BUCKETS, bucket_for, bucket_upper, percentiles
+
+NODE_PROBE_INTERVAL = float(os.getenv("NODE_PROBE_INTERVAL", "1.0"))
+NODE_PROBE_TIMEOUT = float(os.getenv("NODE_PROBE_TIMEOUT", "2.0"))
+# Samples kept per node and operation for the rolling histograms
+NODE_PROBE_WINDOW = int(os.getenv("NODE_PROBE_WINDOW", "300"))
+
+RESULTS_FILE = "node-latency.json"
+PROBE_TABLE = "defaultdb.chaos_probe"
+# Probe rows for nodes live above the ids used by the TTR prober
+NODE_ROW_BASE = 1_000_000
+
+OPS = ("select1", "read", "write")
+
+
+async def _wait(conn):
+    """Drive an async psycopg2 connection until the current operation completes"""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+        fut = loop.create_future()
+        fd = conn.fileno()
+        add(fd, lambda: fut.done() or fut.set_result(None))
+        try:
+            await fut
+        finally:
+            remove(fd)
+
+
+class RollingHistogram:
+    def __init__(self, window=NODE_PROBE_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.counts = [0] * BUCKETS
+        self.last_ms = None
+
+    def record(self, ms):
+        if len(self.samples) == self.samples.maxlen:
+            self.counts[self.samples[0]] -= 1
+        bucket = bucket_for(ms)
+        self.samples.append(bucket)
+        self.counts[bucket] += 1
+        self.last_ms = round(ms, 3)
+
+    def summary(self):
+        return {
+            **percentiles(self.counts),
+            "last_ms": self.last_ms,
+            "buckets": [[round(bucket_upper(i), 3), n] for i, n in enumerate(self.counts) if n],
+        }
+
+
+class NodeState:
+    def __init__(self, target, row):
+        self.target = target
+        self.row = row
+        self.conn = None
+        self.node_id = None
+        self.ok = None
+        self.error = None
+        self.failures = 0
+        self.histograms = {op: RollingHistogram() for op in OPS}
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+class NodeProber:
+    def __init__(self, connect_kwargs, targets, interval=NODE_PROBE_INTERVAL, timeout=NODE_PROBE_TIMEOUT):
+        """``targets()`` returns {node: {"region", "host", "port"}} for the nodes to probe"""
+        self.connect_kwargs = connect_kwargs
+        self.targets = targets
+        self.interval = interval
+        self.timeout = timeout
+        self._leader = shared_state.FileLock("node-probe.leader.lock")
+        self._nodes = {}
+        self._results = shared_state.CachedJson(RESULTS_FILE)
+
+    async def _execute(self, conn, sql, args=None):
+        # Async cursors return from execute() at once, so time the statement here
+        started = time.perf_counter()
+        ok = False
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql, args)
+                await _wait(conn)
+                ok = True
+                return cur.fetchone() if cur.description else None
+        finally:
+            metrics.observe_sql(sql, time.perf_counter() - started, ok)
+
+    async def _connect(self, state):
+        conn = psycopg2.connect(
+            host=state.target["host"], port=state.target["port"],
+            connect_timeout=max(1, int(self.timeout)), async_=True, **self.connect_kwargs
+        )
+        await _wait(conn)
+        state.conn = conn
+        try:
+            (state.node_id,) = await self._execute(conn, "SELECT crdb_internal.node_id()")
+        except psycopg2.Error:
+            pass
+
+    async def _probe_once(self, state):
+        if state.conn is None or state.conn.closed:
+            await self._connect(state)
+        conn = state.conn
+        timings = {}
+        for op, sql, args in (
+            ("select1", "SELECT 1", None),
+            ("read", f"SELECT at FROM {PROBE_TABLE} WHERE id = %s", (state.row,)),
+            ("write", f"INSERT INTO {PROBE_TABLE} (id, at) VALUES (%s, now()) "
+                      "ON CONFLICT (id) DO UPDATE SET at = excluded.at", (state.row,)),
+        ):
+            started = time.perf_counter()
+            await self._execute(conn, sql, args)
+            timings[op] = (time.perf_counter() - started) * 1000
+        return timings
+
+    async def _probe(self, state):
+        try:
+            timings = await asyncio.wait_for(self._probe_once(state), self.timeout)
+        except Exception as e:
+            # A half-finished async query leaves the connection unusable; start over next tick
+            state.close()
+            state.ok, state.error = False, " ".join(str(e).split()) or type(e).__name__
+            state.failures += 1
+            return
+        for op, ms in timings.items():
+            state.histograms[op].record(ms)
+        state.ok, state.error = True, None
+
+    def _sync_targets(self):
+        targets = self.targets() or {}
+        for name in list(self._nodes):
+            if name not in targets:
+                self._nodes.pop(name).close()
+        for i, (name, target) in enumerate(sorted(targets.items())):
+            state = self._nodes.get(name)
+            if state is None or state.target != target:
+                if state is not None:
+                    state.close()
+                self._nodes[name] = NodeState(target, NODE_ROW_BASE + i)
+
+    def _publish(self):
+        shared_state.write_json(RESULTS_FILE, {
+            "collected_at": time.time(),
+            "interval": self.interval,
+            "window": NODE_PROBE_WINDOW,
+            "nodes": {
+                name: {
+                    **s.target, "node_id": s.node_id, "ok": s.ok, "error": s.error, "failures": s.failures,
+                    "ops": {op: h.summary() for op, h in s.histograms.items()},
+                }
+                for name, s in sorted(self._nodes.items())
+            },
+        })
+
+    async def run(self):
+        """Background loop: the worker holding the leader lock probes every node each interval"""
+        try:
+            await shared_state.lead(self._leader, self._round, lambda started: self.interval - (time.monotonic() - started))
+        finally:
+            for state in self._nodes.values():
+                state.close()
+
+    async def _round(self):
+        self._sync_targets()
+        await asyncio.gather(*(self._probe(s) for s in self._nodes.values()))
+        self._publish()
+
+    def results(self):
+        """Latest published results; the file is only re-read when it was replaced"""
+        return self._results.read()
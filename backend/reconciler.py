@@ -0,0 +1,160 @@
+"""Drive Toxiproxy proxies to a desired state with the fewest API calls.
+
+The reconciler diffs the desired state of a proxy (enabled flag plus toxics)
+against a cached view and only issues the calls that differ. Changed
+toxics are updated in place, and new toxics are added before old ones are
+removed, so a brownout never passes through a moment with no toxic at all.
+
+The cached view lives in shared memory so every worker sees it. It is fed by
+each apply and by the snapshot collector's proxy listings. If the cache turns
+out stale, Toxiproxy's 409/404 answers are handled by falling back to the
+right call.
+"""
+import asyncio
+import time
+
+import shared_state
+
+CACHE_FILE = "toxiproxy-state.json"
+CACHE_LOCK = "toxiproxy-state.lock"
+
+
+def normalize_toxic(toxic):
+    return {
+        "name": toxic["name"],
+        "type": toxic["type"],
+        "stream": toxic.get("stream", "downstream"),
+        "toxicity": float(toxic.get("toxicity", 1.0)),
+        "attributes": dict(toxic.get("attributes") or {}),
+    }
+
+
+def proxy_state(proxy):
+    """Reconciler view of a proxy document returned by the Toxiproxy API"""
+    return {
+        "enabled": bool(proxy.get("enabled")),
+        "toxics": {t["name"]: normalize_toxic(t) for t in proxy.get("toxics") or []},
+    }
+
+
+def desired_state(enabled, toxics=()):
+    return {"enabled": enabled, "toxics": {t["name"]: normalize_toxic(t) for t in toxics}}
+
+
+def plan(current, desired):
+    """Ordered phases of (kind, arg) steps; steps within one phase are independent"""
+    have, want = current["toxics"], desired["toxics"]
+    upserts = []
+    for name, toxic in want.items():
+        existing = have.get(name)
+        if existing == toxic:
+            continue
+        if existing is None:
+            upserts.append(("add", toxic))
+        elif existing["type"] != toxic["type"] or existing["stream"] != toxic["stream"]:
+            upserts.append(("replace", toxic))
+        else:
+            upserts.append(("update", toxic))
+    deletes = [("delete", have[name]) for name in have if name not in want]
+    toxic_phases = [phase for phase in (upserts, deletes) if phase]
+
+    if current["enabled"] == desired["enabled"]:
+        return toxic_phases
+    toggle = [("enabled", desired["enabled"])]
+    # Disabling is the fault itself, so it goes first; enabling waits for the toxics
+    return [toggle] + toxic_phases if not desired["enabled"] else toxic_phases + [toggle]
+
+
+def _key(api, name):
+    return f"{api}|{name}"
+
+
+class ToxicReconciler:
+    def __init__(self, client):
+        self.client = client
+        self._locks = {}
+        self._cache = shared_state.CachedJson(CACHE_FILE, {})
+        self.stats = {"applies": 0, "noops": 0, "calls": 0, "stale_cache_fixes": 0}
+
+    def _load(self):
+        return self._cache.read()
+
+    def _store(self, updates):
+        """Merge {key: (state or None, at)} into the shared cache; older observations lose"""
+        with shared_state.FileLock(CACHE_LOCK):
+            data = shared_state.read_json(CACHE_FILE, {})
+            for key, (state, at) in updates.items():
+                if state is None:
+                    data.pop(key, None)
+                elif data.get(key, {}).get("at", 0) <= at:
+                    data[key] = {**state, "at": at}
+            shared_state.write_json(CACHE_FILE, data)
+
+    def observe(self, api, proxies, at):
+        """Record proxies as listed by GET /proxies at time ``at``"""
+        self._store({_key(api, name): (proxy_state(p), at) for name, p in proxies.items()})
+
+    async def current(self, api, name):
+        entry = self._load().get(_key(api, name))
+        if entry is not None:
+            return entry
+        state = proxy_state(await self.client.get_proxy(api, name))
+        self._store({_key(api, name): (state, time.time())})
+        return state
+
+    async def apply(self, api, name, desired, mark=None):
+        """Reconcile one proxy; returns the number of Toxiproxy calls made"""
+        key = _key(api, name)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            phases = plan(await self.current(api, name), desired)
+            self.stats["applies"] += 1
+            if not phases:
+                self.stats["noops"] += 1
+                return 0
+            calls = 0
+            try:
+                for phase in phases:
+                    results = await asyncio.gather(*(self._run(api, name, step) for step in phase))
+                    calls += sum(results)
+                    if mark and phase == [("enabled", False)]:
+                        mark()
+            except BaseException:
+                # The proxy may be half-way; make the next apply re-read it
+                self._store({key: (None, 0)})
+                raise
+            finally:
+                self.stats["calls"] += calls
+            self._store({key: (desired, time.time())})
+            return calls
+
+    async def _run(self, api, name, step):
+        kind, arg = step
+        c = self.client
+        if kind == "enabled":
+            await c.set_enabled(api, name, arg)
+            return 1
+        body = {k: arg[k] for k in ("name", "type", "stream", "toxicity", "attributes")}
+        calls = 1
+        if kind == "add":
+            r = await c.add_toxic(api, name, body)
+            if r.status_code == 409:
+                self.stats["stale_cache_fixes"] += 1
+                r = await c.update_toxic(api, name, arg["name"], body)
+                calls += 1
+        elif kind == "update":
+            r = await c.update_toxic(api, name, arg["name"], body)
+            if r.status_code == 404:
+                self.stats["stale_cache_fixes"] += 1
+                r = await c.add_toxic(api, name, body)
+                calls += 1
+        elif kind == "replace":
+            await c.delete_toxic(api, name, arg["name"])
+            r = await c.add_toxic(api, name, body)
+            calls += 1
+        else:
+            r = await c.delete_toxic(api, name, arg["name"])
+            if r.status_code == 404:
+                return calls
+        r.raise_for_status()
+        return calls
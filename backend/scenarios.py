@@ -0,0 +1,317 @@
+"""Timed chaos scenarios: a fault timeline run on an async scheduler.
+
+A scenario is JSON (or YAML when PyYAML is installed)::
+
+    {"name": "east failover",
+     "steps": [{"at": "10s", "action": "brownout", "region": "us-west-2", "ms": 400},
+               {"at": "40s", "action": "kill", "region": "us-east-1"},
+               {"at": "90s", "action": "recover", "region": "all"}]}
+
+Step offsets are measured on the scenario timeline, which stops while the
+run is paused. Each step is launched as its own task when its time comes,
+so a slow action never delays the next one. Both the scheduled and the
+actual offset of every step are recorded. One scenario runs at a time
+across all workers. Status and pause/abort requests go through shared
+state files, so any worker can serve them.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+import shared_state
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+STATUS_FILE = "scenario.json"
+CONTROL_FILE = "scenario-control.json"
+RUN_LOCK = "scenario.lock"
+# How often a waiting scheduler looks at pause/abort requests
+CONTROL_POLL = 0.05
+# How long a draining worker waits for steps already running after it aborts its scenario
+SCENARIO_STEP_DRAIN = float(os.getenv("SCENARIO_STEP_DRAIN", "15"))
+# Final stretch before a step is waited out by yielding instead of sleeping
+SPIN_THRESHOLD = 0.002
+MAX_BROWNOUT_MS = 60000
+
+_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0}
+
+
+class ScenarioError(ValueError):
+    """Raised for a scenario that cannot be parsed or references unknown actions/regions"""
+
+
+class ScenarioBusy(Exception):
+    """Raised when another scenario is already running"""
+
+
+def parse_offset(value):
+    """Seconds from a number (seconds) or a string like "1500ms", "10s", "2m" """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if value < 0:
+            raise ScenarioError(f"Invalid time offset: {value!r}")
+        return float(value)
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*", str(value))
+    if not m:
+        raise ScenarioError(f"Invalid time offset: {value!r}")
+    return float(m.group(1)) * _UNITS[m.group(2) or "s"]
+
+
+def parse_ms(value):
+    """Whole milliseconds from a number (ms) or a string like "400ms", "1.5s" """
+    if isinstance(value, bool):
+        raise ScenarioError(f"Invalid duration: {value!r}")
+    if isinstance(value, (int, float)):
+        ms = float(value)
+    else:
+        m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(ms|s|m)?\s*", str(value))
+        if not m:
+            raise ScenarioError(f"Invalid duration: {value!r}")
+        ms = float(m.group(1)) * _UNITS[m.group(2) or "ms"] * 1000
+    if not 0 <= ms <= MAX_BROWNOUT_MS:
+        raise ScenarioError(f"Duration {value!r} is outside 0..{MAX_BROWNOUT_MS}ms")
+    return int(round(ms))
+
+
+# Parameters each action takes, with the function that checks and converts a value
+ACTION_PARAMS = {
+    "partition": {},
+    "recover": {},
+    "kill": {},
+    "brownout": {"ms": parse_ms},
+}
+
+
+def load(text):
+    """Decode a scenario document from JSON or YAML text"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        if not YAML_AVAILABLE:
+            raise ScenarioError("Scenario is not valid JSON (install PyYAML for YAML scenarios)")
+    try:
+        return yaml.safe_load(text)
+    except yaml.YAMLError as e:
+        raise ScenarioError(f"Scenario is neither valid JSON nor YAML: {e}")
+
+
+def _params(i, action, raw, schema):
+    unknown = sorted(set(raw) - set(schema))
+    if unknown:
+        allowed = ", ".join(schema) or "none"
+        raise ScenarioError(f"Step {i}: {action} does not take {', '.join(unknown)} (parameters: {allowed})")
+    params = {}
+    for name, value in raw.items():
+        try:
+            params[name] = schema[name](value)
+        except ScenarioError as e:
+            raise ScenarioError(f"Step {i}: {name}: {e}")
+    return params
+
+
+def parse(doc, actions, regions, params=ACTION_PARAMS):
+    """Validate a decoded scenario and expand it into steps sorted by offset
+
+    Every step names its region (or "all") and passes only the parameters ``params`` lists
+    for its action, so a bad file is rejected before any fault is injected.
+    """
+    if isinstance(doc, list):
+        doc = {"steps": doc}
+    if not isinstance(doc, dict) or not isinstance(doc.get("steps"), list) or not doc["steps"]:
+        raise ScenarioError("Scenario needs a non-empty 'steps' list")
+    steps = []
+    for i, raw in enumerate(doc["steps"]):
+        if not isinstance(raw, dict):
+            raise ScenarioError(f"Step {i} is not an object")
+        raw = dict(raw)
+        at = parse_offset(raw.pop("at", raw.pop("t", 0)))
+        action = raw.pop("action", None)
+        if action not in actions:
+            raise ScenarioError(f"Step {i}: unknown action {action!r}, expected one of: {', '.join(actions)}")
+        if "region" not in raw:
+            raise ScenarioError(f"Step {i}: {action} needs a region (a region name or \"all\")")
+        region = raw.pop("region")
+        if region != "all" and region not in regions:
+            raise ScenarioError(f"Step {i}: unknown region {region!r}")
+        steps.append({"at": at, "action": action, "region": region,
+                      "params": _params(i, action, raw, params.get(action, {}))})
+    steps.sort(key=lambda s: s["at"])
+    return {"name": doc.get("name", "scenario"), "steps": steps}
+
+
+def _step_error(region, result):
+    """Why an action failed in ``region``: it raised, or its result reports ops that failed"""
+    if isinstance(result, Exception):
+        return f"{region}: {getattr(result, 'detail', None) or result}"
+    if not isinstance(result, dict):
+        return None
+    failed = [t for t in result.get("timings", []) if not t.get("ok")]
+    if failed:
+        return f"{region}: " + "; ".join(f"{t['target']}: {t['error']}" for t in failed)
+    if result.get("ok") is False:
+        return f"{region}: action reported failure"
+    return None
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ScenarioRunner:
+    def __init__(self, actions, regions):
+        """``actions`` maps an action name to ``async fn(region, **params)``"""
+        self.actions = actions
+        self.regions = list(regions)
+        self._lock = shared_state.FileLock(RUN_LOCK)
+        self._task = None
+
+    def parse(self, text):
+        return parse(load(text), self.actions, self.regions)
+
+    def status(self):
+        return shared_state.read_json(STATUS_FILE)
+
+    def control(self, **flags):
+        """Ask the running scenario (in whichever worker runs it) to pause, resume or abort"""
+        status = self.status()
+        if not status or status["state"] not in ("running", "paused"):
+            return None
+        ctl = shared_state.read_json(CONTROL_FILE, {})
+        if ctl.get("run_id") != status["id"]:
+            ctl = {"run_id": status["id"], "paused": False, "abort": False}
+        ctl.update(flags)
+        shared_state.write_json(CONTROL_FILE, ctl)
+        return ctl
+
+    def start(self, scenario):
+        if not self._lock.try_acquire():
+            raise ScenarioBusy("A scenario is already running")
+        run = {
+            "id": uuid.uuid4().hex[:12],
+            "name": scenario["name"],
+            "state": "running",
+            "started_at": _now(),
+            "finished_at": None,
+            "paused_ms": 0.0,
+            "steps": [
+                {
+                    "index": i, "action": s["action"], "region": s["region"], "params": s["params"],
+                    "status": "pending", "scheduled_ms": round(s["at"] * 1000, 3), "actual_ms": None,
+                    "late_ms": None, "duration_ms": None, "started_at": None, "error": None
+                }
+                for i, s in enumerate(scenario["steps"])
+            ],
+        }
+        shared_state.write_json(CONTROL_FILE, {"run_id": run["id"], "paused": False, "abort": False})
+        shared_state.write_json(STATUS_FILE, run)
+        self._task = asyncio.create_task(self._run(run))
+        return run
+
+    def cancel(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def drain(self, timeout):
+        """Let a scenario running in this worker finish; past ``timeout`` stop it between steps, not mid-step"""
+        if self._task is None or self._task.done():
+            return
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            self.control(abort=True)
+            # The abort is noticed within CONTROL_POLL; steps already running still finish
+            await asyncio.wait({self._task}, timeout=SCENARIO_STEP_DRAIN)
+
+    async def _run(self, run):
+        loop = asyncio.get_running_loop()
+        clock = {"t0": loop.time(), "paused_total": 0.0, "paused_at": None}
+
+        def elapsed():
+            now = loop.time()
+            paused = clock["paused_total"] + (now - clock["paused_at"] if clock["paused_at"] is not None else 0.0)
+            return now - clock["t0"] - paused
+
+        def poll_control():
+            ctl = shared_state.read_json(CONTROL_FILE, {})
+            if ctl.get("run_id") != run["id"]:
+                return False
+            if ctl.get("paused") and clock["paused_at"] is None:
+                clock["paused_at"] = loop.time()
+                run["state"] = "paused"
+                shared_state.write_json(STATUS_FILE, run)
+            elif not ctl.get("paused") and clock["paused_at"] is not None:
+                clock["paused_total"] += loop.time() - clock["paused_at"]
+                clock["paused_at"] = None
+                run["state"] = "running"
+                run["paused_ms"] = round(clock["paused_total"] * 1000, 3)
+                shared_state.write_json(STATUS_FILE, run)
+            return bool(ctl.get("abort"))
+
+        async def wait_until(target):
+            """False if aborted before the timeline reached ``target``"""
+            next_poll = 0.0
+            while True:
+                now = loop.time()
+                if now >= next_poll:
+                    if poll_control():
+                        return False
+                    next_poll = now + CONTROL_POLL
+                if clock["paused_at"] is not None:
+                    await asyncio.sleep(CONTROL_POLL)
+                    continue
+                remaining = target - elapsed()
+                if remaining <= 0:
+                    return True
+                if remaining > SPIN_THRESHOLD:
+                    await asyncio.sleep(min(remaining - SPIN_THRESHOLD, CONTROL_POLL))
+                else:
+                    # Sleep granularity is about a millisecond; yield through the final stretch
+                    await asyncio.sleep(0)
+
+        async def execute(step, target):
+            step["actual_ms"] = round(elapsed() * 1000, 3)
+            step["late_ms"] = round(step["actual_ms"] - target * 1000, 3)
+            step["started_at"] = _now()
+            step["status"] = "running"
+            shared_state.write_json(STATUS_FILE, run)
+            started = time.perf_counter()
+            regions = self.regions if step["region"] == "all" else [step["region"]]
+            results = await asyncio.gather(
+                *(self.actions[step["action"]](region, **step["params"]) for region in regions),
+                return_exceptions=True
+            )
+            step["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            errors = [error for r, result in zip(regions, results) if (error := _step_error(r, result))]
+            step["status"] = "failed" if errors else "done"
+            step["error"] = "; ".join(errors) or None
+            shared_state.write_json(STATUS_FILE, run)
+
+        launched = []
+        try:
+            for step in run["steps"]:
+                target = step["scheduled_ms"] / 1000
+                if not await wait_until(target):
+                    run["state"] = "aborted"
+                    break
+                launched.append(asyncio.create_task(execute(step, target)))
+            # Steps already running are allowed to finish; a half-applied fault is worse than a late abort
+            await asyncio.gather(*launched)
+            if run["state"] != "aborted":
+                run["state"] = "failed" if any(s["status"] == "failed" for s in run["steps"]) else "completed"
+        except asyncio.CancelledError:
+            run["state"] = "aborted"
+            raise
+        finally:
+            for step in run["steps"]:
+                if step["status"] == "pending":
+                    step["status"] = "skipped"
+            run["finished_at"] = _now()
+            run["paused_ms"] = round(clock["paused_total"] * 1000, 3)
+            shared_state.write_json(STATUS_FILE, run)
+            self._lock.release()
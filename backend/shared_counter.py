@@ -0,0 +1,135 @@
+"""Transaction counter shared by all gunicorn workers through an mmap'd file.
+
+The file holds one slot per process. A worker claims a free slot with a
+byte-range lock (dropped by the kernel when the worker exits) and is that
+slot's only writer, so increments never take a cross-process lock. Readers
+sum all slots. Slot totals stay in the file, so a recycled worker's count is
+kept and continued by whichever process claims the slot next. Each slot also
+keeps a ring of per-second buckets for rate tracking.
+"""
+import fcntl
+import os
+import struct
+import threading
+import time
+
+import shared_state
+
+SLOTS = 64
+RING_SECONDS = 64
+
+_HEADER = struct.Struct("<8sII")
+_MAGIC = b"CHAOSCNT"
+_U64 = struct.Struct("<Q")
+_BUCKET = struct.Struct("<QQ")  # (unix second, count)
+_SLOT_SIZE = _U64.size + RING_SECONDS * _BUCKET.size
+
+
+class SlotFile:
+    """An mmap'd file of fixed-size slots, one per process, each with a single writer.
+
+    Subclasses define the slot layout; this class handles the per-process
+    mapping and slot claiming.
+    """
+
+    def __init__(self, name, magic, slot_size, slots=SLOTS, meta=RING_SECONDS):
+        self.name = name
+        self._magic = magic
+        self._slot_size = slot_size
+        self._slots = slots
+        self._meta = meta
+        self._file_size = _HEADER.size + slots * slot_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._mm = None
+        self._slot = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        # A descriptor inherited across fork is left open on purpose: closing any
+        # descriptor of the file would drop this process's byte-range locks
+        self._fd, self._mm = shared_state.map_file(
+            self.name, self._file_size, _HEADER.pack(self._magic, self._slots, self._meta)
+        )
+        self._pid = os.getpid()
+        self._slot = None
+
+    def _slot_offset(self, slot):
+        return _HEADER.size + slot * self._slot_size
+
+    def _claim_slot(self):
+        for slot in range(self._slots):
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self._slot_offset(slot))
+            except OSError:
+                continue
+            self._slot = slot
+            return
+        raise RuntimeError(f"All {self._slots} slots in {self.name} are in use")
+
+    def _own_slot(self):
+        """Offset of this process's slot, claiming one on first use (call with self._lock held)"""
+        self._open()
+        if self._slot is None:
+            self._claim_slot()
+        return self._slot_offset(self._slot)
+
+
+class SharedCounter(SlotFile):
+    def __init__(self, name="transactions.counter"):
+        super().__init__(name, _MAGIC, _SLOT_SIZE)
+
+    def increment(self, n=1):
+        if n <= 0:
+            return
+        with self._lock:
+            base = self._own_slot()
+            mm = self._mm
+            (total,) = _U64.unpack_from(mm, base)
+            _U64.pack_into(mm, base, total + n)
+
+            now = int(time.time())
+            bucket = base + _U64.size + (now % RING_SECONDS) * _BUCKET.size
+            second, count = _BUCKET.unpack_from(mm, bucket)
+            if second == now:
+                _U64.pack_into(mm, bucket + 8, count + n)
+            else:
+                # Reset the count before stamping the second so readers never pair
+                # the new second with the old count
+                _U64.pack_into(mm, bucket + 8, n)
+                _U64.pack_into(mm, bucket, now)
+
+    def total(self):
+        self._open()
+        return sum(_U64.unpack_from(self._mm, self._slot_offset(s))[0] for s in range(SLOTS))
+
+    def count_at(self, second):
+        """Increments made during one unix second, if it is still within the ring"""
+        self._open()
+        count = 0
+        for slot in range(SLOTS):
+            bucket = self._slot_offset(slot) + _U64.size + (second % RING_SECONDS) * _BUCKET.size
+            stamp, n = _BUCKET.unpack_from(self._mm, bucket)
+            if stamp == second:
+                count += n
+        return count
+
+    def rate(self, window=1):
+        """Average increments per second over the last ``window`` complete seconds"""
+        window = max(1, min(window, RING_SECONDS - 1))
+        self._open()
+        now = int(time.time())
+        oldest = now - window
+        count = 0
+        for slot in range(SLOTS):
+            base = self._slot_offset(slot)
+            if not _U64.unpack_from(self._mm, base)[0]:
+                continue  # never written
+            for sec in range(oldest, now):
+                bucket = base + _U64.size + (sec % RING_SECONDS) * _BUCKET.size
+                second, n = _BUCKET.unpack_from(self._mm, bucket)
+                if second == sec:
+                    count += n
+        return count / window
@@ -0,0 +1,97 @@
+"""Per-second latency histograms shared by all gunicorn workers.
+
+Uses the same one-slot-per-process mmap layout as ``SharedCounter``. Each
+slot keeps a short ring of seconds, and each second holds log-spaced
+buckets (20% wide), so percentiles from the merged histogram are accurate
+to within one bucket.
+"""
+import math
+import struct
+import time
+
+from shared_counter import SlotFile
+
+RING_SECONDS = 8
+BUCKETS = 64
+# Lower edge of bucket 1 (ms) and the growth factor between bucket edges
+LOWEST_MS = 0.05
+GROWTH = 1.2
+
+_MAGIC = b"CHAOSLAT"
+_STAMP = struct.Struct("<Q")
+_COUNTS = struct.Struct(f"<{BUCKETS}I")
+_SECOND_SIZE = _STAMP.size + _COUNTS.size
+_SLOT_SIZE = RING_SECONDS * _SECOND_SIZE
+_LOG_GROWTH = math.log(GROWTH)
+
+
+def bucket_for(ms):
+    if ms < LOWEST_MS:
+        return 0
+    return min(BUCKETS - 1, 1 + int(math.log(ms / LOWEST_MS) / _LOG_GROWTH))
+
+
+def bucket_value(index):
+    """Representative latency (ms) of a bucket: the midpoint of its edges"""
+    if index == 0:
+        return LOWEST_MS / 2
+    low = LOWEST_MS * GROWTH ** (index - 1)
+    return low * (1 + GROWTH) / 2
+
+
+def bucket_upper(index):
+    """Upper edge (ms) of a bucket; the last bucket is open-ended"""
+    return LOWEST_MS * GROWTH ** index
+
+
+def percentiles(counts, pcts=(50, 95, 99)):
+    """{"p50": ms, ...} plus "max" and "count" from merged bucket counts"""
+    total = sum(counts)
+    result = {"count": total}
+    if not total:
+        return {**result, **{f"p{p}": None for p in pcts}, "max": None}
+    for p in pcts:
+        rank = max(1, math.ceil(total * p / 100))
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                result[f"p{p}"] = round(bucket_value(i), 3)
+                break
+    top = max(i for i, n in enumerate(counts) if n)
+    result["max"] = round(bucket_value(top), 3)
+    return result
+
+
+class SharedLatency(SlotFile):
+    def __init__(self, name="latency.hist"):
+        super().__init__(name, _MAGIC, _SLOT_SIZE, meta=RING_SECONDS)
+
+    def record(self, ms):
+        now = int(time.time())
+        with self._lock:
+            base = self._own_slot() + (now % RING_SECONDS) * _SECOND_SIZE
+            mm = self._mm
+            (stamp,) = _STAMP.unpack_from(mm, base)
+            if stamp != now:
+                # Zero the counts before stamping, as in SharedCounter.increment
+                mm[base + _STAMP.size:base + _SECOND_SIZE] = bytes(_COUNTS.size)
+                _STAMP.pack_into(mm, base, now)
+            offset = base + _STAMP.size + 4 * bucket_for(ms)
+            (n,) = struct.unpack_from("<I", mm, offset)
+            struct.pack_into("<I", mm, offset, n + 1)
+
+    def counts_at(self, second):
+        """Bucket counts of one unix second merged over every worker"""
+        self._open()
+        merged = [0] * BUCKETS
+        for slot in range(self._slots):
+            base = self._slot_offset(slot) + (second % RING_SECONDS) * _SECOND_SIZE
+            if _STAMP.unpack_from(self._mm, base)[0] != second:
+                continue
+            for i, n in enumerate(_COUNTS.unpack_from(self._mm, base + _STAMP.size)):
+                merged[i] += n
+        return merged
+
+    def summary_at(self, second):
+        return percentiles(self.counts_at(second))
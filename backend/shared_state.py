@@ -0,0 +1,145 @@
+"""Small helpers for state shared between gunicorn workers through files in /dev/shm"""
+import asyncio
+import fcntl
+import json
+import mmap
+import os
+import tempfile
+import time
+
+_default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+STATE_DIR = os.getenv("CHAOS_STATE_DIR", os.path.join(_default_dir, "cockroach-chaos-demo"))
+
+
+def path(name):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def write_json(name, obj):
+    """Atomically replace a shared JSON document so readers never see partial writes"""
+    target = path(name)
+    fd, tmp = tempfile.mkstemp(dir=STATE_DIR, prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(obj, f, default=str)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def read_json(name, default=None):
+    try:
+        with open(path(name)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+class CachedJson:
+    """A shared JSON document, re-read only when the file was replaced (new inode or mtime)"""
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        self._data = None
+        self._key = None
+
+    def read(self):
+        try:
+            st = os.stat(path(self.name))
+        except FileNotFoundError:
+            return self.default
+        key = (st.st_ino, st.st_mtime_ns)
+        if key != self._key:
+            data = read_json(self.name)
+            if data is None:
+                return self.default if self._data is None else self._data
+            self._data, self._key = data, key
+        return self._data
+
+
+def map_file(name, size, header, exact=False):
+    """(fd, mmap) of a shared file of ``size`` bytes, created with ``header`` at offset 0
+
+    The file is set up under flock, so only one process writes the header. A file smaller
+    than ``size`` (or of any other size when ``exact``) is truncated and started over. The
+    caller owns the descriptor.
+    """
+    fd = os.open(path(name), os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        current = os.fstat(fd).st_size
+        if current < size or (exact and current != size):
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, header, 0)
+        mm = mmap.mmap(fd, size)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    return fd, mm
+
+
+class FileLock:
+    """Inter-process lock built on flock(); released automatically if the holder dies"""
+
+    def __init__(self, name):
+        self.name = name
+        self._fd = None
+
+    def try_acquire(self):
+        fd = os.open(path(self.name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def acquire(self):
+        fd = os.open(path(self.name), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._fd = fd
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+async def lead(lock, step, delay, standby=None):
+    """Background loop run by every worker, of which only the holder of ``lock`` works.
+
+    Each round, a worker that holds ``lock`` (or takes it over because its holder died)
+    awaits ``step()``; the others call ``standby()``. The round then sleeps ``delay(started)``
+    seconds, ``started`` being its ``time.monotonic()`` start. Errors in a step are dropped so
+    the leader keeps leading; the lock is released when the loop is cancelled.
+    """
+    try:
+        while True:
+            started = time.monotonic()
+            if lock.held or lock.try_acquire():
+                try:
+                    await step()
+                except Exception:
+                    pass
+            elif standby is not None:
+                standby()
+            await asyncio.sleep(max(0.0, delay(started)))
+    finally:
+        lock.release()
@@ -0,0 +1,141 @@
+"""Versioned cluster-state snapshot built by one collector and shared by all workers.
+
+Every gunicorn worker runs ``SnapshotService.run()``, but only the worker that
+wins a non-blocking flock actually collects; the others stand by and take over
+if the leader dies or is recycled. Snapshots are published as an atomically
+replaced JSON file in shared memory, so serving one is a stat() plus, when the
+version changed, one small JSON parse, whatever the number of viewers.
+"""
+import asyncio
+import os
+import time
+
+import shared_state
+from shared_counter import SharedCounter
+
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "1.0"))
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", str(max(5.0, SNAPSHOT_INTERVAL * 5))))
+# Oldest snapshot a request is served without refreshing; defaults to SNAPSHOT_MAX_AGE
+SNAPSHOT_MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS_MS", str(SNAPSHOT_MAX_AGE * 1000))) / 1000
+# How long a worker waits for another worker's collection before collecting itself
+COLLECT_WAIT_TIMEOUT = 10.0
+
+COALESCING_STATS = ("requests", "served_cached", "coalesced_local", "coalesced_remote", "collected")
+
+
+def age(snap):
+    """Seconds since the snapshot was collected"""
+    return max(0.0, time.time() - snap["collected_at"])
+
+
+class SnapshotService:
+    def __init__(self, collect, name="snapshot", interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE,
+                 max_staleness=SNAPSHOT_MAX_STALENESS):
+        self.collect = collect
+        self.interval = interval
+        self.max_age = max_age
+        self.max_staleness = max_staleness
+        self._file = f"{name}.json"
+        self._leader = shared_state.FileLock(f"{name}.leader.lock")
+        self._publish_lock = f"{name}.publish.lock"
+        self._collect_lock = f"{name}.collect.lock"
+        self._stats = {stat: SharedCounter(f"{name}.{stat}.counter") for stat in COALESCING_STATS}
+        self._doc = shared_state.CachedJson(self._file)
+        self._refreshing = None
+        self._pending = set()
+
+    @property
+    def is_leader(self):
+        return self._leader.held
+
+    async def run(self):
+        """Background loop: the worker holding the leader lock collects, the others stand by"""
+        await shared_state.lead(self._leader, self.refresh, lambda started: self.interval - (time.monotonic() - started))
+
+    async def refresh(self, max_staleness=None):
+        """Collect and publish now, coalescing with collections already running in any worker.
+
+        Concurrent callers in this worker share one in-flight collection. Across
+        workers, only one collects at a time; a worker that had to wait for another
+        one's collection takes its result if it is within ``max_staleness``.
+        """
+        if self._refreshing is None:
+            limit = self.max_staleness if max_staleness is None else max_staleness
+            self._refreshing = asyncio.ensure_future(self._collect_or_join(limit))
+            self._refreshing.add_done_callback(self._refresh_done)
+        else:
+            self._stats["coalesced_local"].increment()
+        return await asyncio.shield(self._refreshing)
+
+    def _refresh_done(self, task):
+        self._refreshing = None
+
+    def request_refresh(self):
+        """Schedule a refresh without waiting for it, e.g. right after a chaos action"""
+        task = asyncio.ensure_future(self.refresh())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _collect_or_join(self, max_staleness):
+        lock = shared_state.FileLock(self._collect_lock)
+        waited = False
+        deadline = time.monotonic() + COLLECT_WAIT_TIMEOUT
+        while not lock.try_acquire():
+            waited = True
+            if time.monotonic() > deadline:
+                break  # the collecting worker is stuck; don't wait on it forever
+            await asyncio.sleep(0.01)
+        try:
+            if waited:
+                snap = self.current()
+                if snap is not None and age(snap) <= max_staleness:
+                    self._stats["coalesced_remote"].increment()
+                    return snap
+            self._stats["collected"].increment()
+            return await self._collect_and_publish()
+        finally:
+            lock.release()
+
+    async def _collect_and_publish(self):
+        started_at = time.time()
+        data = await self.collect()
+        with shared_state.FileLock(self._publish_lock):
+            current = shared_state.read_json(self._file) or {}
+            # A slower collection that started earlier must not replace a newer one
+            if current.get("started_at", 0) > started_at:
+                return current
+            snap = {
+                "version": current.get("version", 0) + 1,
+                "started_at": started_at,
+                "collected_at": time.time(),
+                "collector_pid": os.getpid(),
+                "data": data,
+            }
+            shared_state.write_json(self._file, snap)
+        return snap
+
+    def current(self):
+        """Latest published snapshot; the file is only re-read when it was replaced"""
+        return self._doc.read()
+
+    async def get(self, max_staleness=None):
+        """Latest snapshot, refreshed inline if none exists yet or it is older than ``max_staleness``"""
+        limit = self.max_staleness if max_staleness is None else max_staleness
+        self._stats["requests"].increment()
+        snap = self.current()
+        if snap is None or age(snap) > limit:
+            return await self.refresh(limit)
+        self._stats["served_cached"].increment()
+        return snap
+
+    def coalescing_stats(self):
+        """Request/collection counters summed over every worker since the counters were created"""
+        totals = {stat: counter.total() for stat, counter in self._stats.items()}
+        coalesced = totals["coalesced_local"] + totals["coalesced_remote"]
+        refreshes = coalesced + totals["collected"]
+        return {
+            **totals,
+            "max_staleness_ms": round(self.max_staleness * 1000),
+            # Share of refreshes that reused another caller's collection instead of collecting
+            "coalesced_ratio": round(coalesced / refreshes, 3) if refreshes else 0.0,
+        }
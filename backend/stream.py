@@ -0,0 +1,54 @@
+"""Server-Sent Events helpers: push only the fields of the panel state that changed"""
+import asyncio
+import json
+import os
+import time
+
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "0.2"))
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))
+# Streams end after this many seconds and the browser reconnects on its own, which
+# keeps long-lived connections from holding up a recycling worker
+STREAM_MAX_AGE = float(os.getenv("STREAM_MAX_AGE", "60"))
+STREAM_RETRY_MS = 1000
+
+
+def diff(old, new):
+    """Nested delta from old to new; removed keys map to None. Returns {} when equal."""
+    delta = {}
+    for key, value in new.items():
+        before = old.get(key)
+        if isinstance(value, dict) and isinstance(before, dict):
+            sub = diff(before, value)
+            if sub:
+                delta[key] = sub
+        elif before != value or key not in old:
+            delta[key] = value
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    return delta
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+async def event_stream(request, get_state, interval=STREAM_POLL_INTERVAL):
+    """Yield a full ``snapshot`` event, then ``delta`` events whenever get_state() changes"""
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    state = get_state()
+    yield format_event("snapshot", state)
+    opened = last_sent = time.monotonic()
+    while time.monotonic() - opened < STREAM_MAX_AGE:
+        await asyncio.sleep(interval)
+        if await request.is_disconnected():
+            return
+        new_state = get_state()
+        delta = diff(state, new_state)
+        if delta:
+            state = new_state
+            last_sent = time.monotonic()
+            yield format_event("delta", delta)
+        elif time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
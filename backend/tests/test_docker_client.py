@@ -0,0 +1,132 @@
+"""DockerClient against a fake Engine API served on a local Unix socket.
+
+Run from backend/: python -m unittest discover tests
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CHAOS_STATE_DIR", tempfile.mkdtemp(prefix="chaos-test-state-"))
+
+from docker_client import DockerClient, DockerError  # noqa: E402
+
+
+class FakeDocker:
+    """Just enough of the Engine API over HTTP/1.1 (keep-alive) for the client's calls"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.containers = {"roach-east-1": "running", "roach-west-1": "exited"}
+        self.requests = []
+        self._server = None
+        self._handlers = set()
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_unix_server(self._serve, path=self.socket_path)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        # Idle keep-alive handlers are parked in readline(); stop them before the loop goes away
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, _ = line.decode().split(" ", 2)
+                headers = {}
+                while (header := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = header.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests.append((method, target, body))
+                status, payload = self._route(method, target.split("?")[0])
+                data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    def _route(self, method, path):
+        if path == "/_ping":
+            return 200, b"OK"
+        if path == "/containers/json":
+            return 200, [{"Names": [f"/{name}"], "State": state} for name, state in self.containers.items()]
+        parts = path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "containers":
+            name, op = parts[1], parts[2]
+            if name not in self.containers:
+                return 404, {"message": f"No such container: {name}"}
+            if op == "json" and method == "GET":
+                return 200, {"Name": f"/{name}", "State": {"Status": self.containers[name]}}
+            if op == "kill" and method == "POST":
+                self.containers[name] = "exited"
+                return 204, b""
+            if op == "start" and method == "POST":
+                if self.containers[name] == "running":
+                    return 304, b""
+                self.containers[name] = "running"
+                return 204, b""
+        return 404, {"message": "page not found"}
+
+
+class DockerClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.client = DockerClient(socket_path=os.path.join(self.tmp.name, "docker.sock"), timeout=2)
+        # httpx loads an SSL context for every transport; do it before the loop's slow-callback check
+        self.client._http()
+
+    async def asyncSetUp(self):
+        self.fake = await FakeDocker(self.client.socket_path).__aenter__()
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.fake.__aexit__(None, None, None)
+        self.tmp.cleanup()
+
+    async def test_ping_and_list(self):
+        self.assertTrue(await self.client.ping())
+        names = [c["Names"][0] for c in await self.client.list_containers()]
+        self.assertEqual(names, ["/roach-east-1", "/roach-west-1"])
+        self.assertEqual(await self.client.container_states(), {"roach-east-1": "running", "roach-west-1": "exited"})
+        self.assertIn(("GET", "/containers/json?all=1", b""), self.fake.requests)
+
+    async def test_inspect(self):
+        info = await self.client.inspect_container("roach-east-1")
+        self.assertEqual(info["State"]["Status"], "running")
+
+    async def test_kill_then_start(self):
+        await self.client.kill("roach-east-1")
+        self.assertEqual((await self.client.container_states())["roach-east-1"], "exited")
+        self.assertTrue(await self.client.start("roach-east-1"))
+        self.assertEqual((await self.client.container_states())["roach-east-1"], "running")
+        # Already running: the daemon answers 304, which is not an error
+        self.assertFalse(await self.client.start("roach-east-1"))
+        kill = next(r for r in self.fake.requests if r[1].startswith("/containers/roach-east-1/kill"))
+        self.assertEqual(kill[1], "/containers/roach-east-1/kill?signal=SIGKILL")
+
+    async def test_errors_carry_the_daemon_message(self):
+        with self.assertRaises(DockerError) as cm:
+            await self.client.inspect_container("missing")
+        self.assertEqual(cm.exception.status_code, 404)
+        self.assertEqual(cm.exception.message, "No such container: missing")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+"""Per-second timeline of write throughput, write latency, region state and chaos events.
+
+One worker (elected by flock, as in ``SnapshotService``) samples the
+shared counter, the latency histograms and the latest snapshot once per
+second. It writes the samples into a fixed-size ring of binary records in
+shared memory, and any worker can read them back. Chaos events are rare,
+so they go into a small JSON list that is capped at a fixed length.
+"""
+import csv
+import io
+import math
+import os
+import struct
+import time
+from datetime import datetime, timezone
+
+import shared_state
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+TIMELINE_SECONDS = int(os.getenv("TIMELINE_SECONDS", "3600"))
+TIMELINE_MAX_EVENTS = int(os.getenv("TIMELINE_MAX_EVENTS", "1000"))
+# Sample a second this long after it ended so late increments still land in it
+SAMPLE_DELAY = 0.05
+
+_HEADER = struct.Struct("<8sII")
+_MAGIC = b"CHAOSTL1"
+# second, writes, latency samples, p50, p95, p99, max (ms; NaN when empty), region up mask, region known mask
+_RECORD = struct.Struct("<QIIffffII")
+EVENTS_FILE = "timeline-events.json"
+EVENTS_LOCK = "timeline-events.lock"
+
+EXPORT_FORMATS = ("json", "csv", "arrow", "parquet")
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _ms(value):
+    return None if value is None or math.isnan(value) else round(value, 3)
+
+
+class Timeline:
+    def __init__(self, counter, latency, region_states, regions, capacity=TIMELINE_SECONDS, name="timeline"):
+        """``region_states()`` returns {region: up} from the latest snapshot, or None"""
+        self.counter = counter
+        self.latency = latency
+        self.region_states = region_states
+        self.regions = list(regions)
+        self.capacity = capacity
+        self._file = f"{name}.ring"
+        self._leader = shared_state.FileLock(f"{name}.leader.lock")
+        self._size = _HEADER.size + capacity * _RECORD.size
+        self._pid = None
+        self._mm = None
+        self._last_up = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        # A different TIMELINE_SECONDS changes the size: start over
+        fd, self._mm = shared_state.map_file(
+            self._file, self._size, _HEADER.pack(_MAGIC, self.capacity, len(self.regions)), exact=True
+        )
+        os.close(fd)
+        self._pid = os.getpid()
+
+    def _offset(self, second):
+        return _HEADER.size + (second % self.capacity) * _RECORD.size
+
+    def event(self, kind, region=None, at=None, **detail):
+        """Record a chaos action or state change; safe to call from any worker"""
+        entry = {"at": at or time.time(), "kind": kind, "region": region, **detail}
+        with shared_state.FileLock(EVENTS_LOCK):
+            events = shared_state.read_json(EVENTS_FILE, [])
+            events.append(entry)
+            shared_state.write_json(EVENTS_FILE, events[-TIMELINE_MAX_EVENTS:])
+
+    def _sample(self, second):
+        lat = self.latency.summary_at(second)
+        states = self.region_states() or {}
+        up_mask = known_mask = 0
+        for i, region in enumerate(self.regions):
+            if states.get(region) is not None:
+                known_mask |= 1 << i
+                if states[region]:
+                    up_mask |= 1 << i
+        nan = float("nan")
+        record = _RECORD.pack(
+            second, self.counter.count_at(second), lat["count"],
+            *(nan if lat[k] is None else lat[k] for k in ("p50", "p95", "p99", "max")),
+            up_mask, known_mask
+        )
+        offset = self._offset(second)
+        # Write the body with a zero stamp first so readers never pair it with an old second
+        self._mm[offset:offset + _RECORD.size] = b"\0" * 8 + record[8:]
+        self._mm[offset:offset + 8] = record[:8]
+
+        if self._last_up is not None:
+            for region in self.regions:
+                before, now = self._last_up.get(region), states.get(region)
+                if before is not None and now is not None and before != now:
+                    self.event("region_up" if now else "region_down", region, at=float(second))
+        self._last_up = states
+
+    async def run(self):
+        """Background loop: the worker holding the leader lock samples each completed second"""
+        last = None
+
+        async def sample():
+            nonlocal last
+            self._open()
+            second = int(time.time()) - 1
+            # Catch up on seconds missed while the loop was stalled (the sources keep a few)
+            start = second if last is None else max(last + 1, second - 7)
+            for sec in range(start, second + 1):
+                self._sample(sec)
+            last = second
+
+        def standby():
+            nonlocal last
+            last = None
+
+        def until_next_second(started):
+            now = time.time()
+            return math.floor(now) + 1 + SAMPLE_DELAY - now
+
+        await shared_state.lead(self._leader, sample, until_next_second, standby)
+
+    def samples(self, since=None, until=None):
+        """Per-second samples in [since, until), oldest first"""
+        self._open()
+        now = int(time.time())
+        until = min(now, int(until) if until is not None else now)
+        start = max(int(since) if since is not None else now - 300, now - self.capacity + 1)
+        rows = []
+        for second in range(start, until):
+            record = _RECORD.unpack_from(self._mm, self._offset(second))
+            if record[0] != second:
+                continue
+            _, writes, count, p50, p95, p99, top, up_mask, known_mask = record
+            rows.append({
+                "second": second,
+                "time": _iso(second),
+                "writes": writes,
+                "latency_samples": count,
+                "p50_ms": _ms(p50), "p95_ms": _ms(p95), "p99_ms": _ms(p99), "max_ms": _ms(top),
+                "regions": {
+                    region: bool(up_mask >> i & 1) if known_mask >> i & 1 else None
+                    for i, region in enumerate(self.regions)
+                },
+            })
+        return rows
+
+    def events(self, since=None, until=None):
+        events = shared_state.read_json(EVENTS_FILE, [])
+        return sorted(
+            ({**e, "time": _iso(e["at"])} for e in events
+             if (since is None or e["at"] >= since) and (until is None or e["at"] < until)),
+            key=lambda e: e["at"]
+        )
+
+    def query(self, since=None, until=None):
+        return {"samples": self.samples(since, until), "events": self.events(since, until)}
+
+    def rows(self, since=None, until=None):
+        """Flat rows for export: region state as up_<region> columns, that second's events joined"""
+        by_second = {}
+        for e in self.events(since, until):
+            label = e["kind"] + (f" {e['region']}" if e.get("region") else "")
+            by_second.setdefault(int(e["at"]), []).append(label)
+        rows = []
+        for s in self.samples(since, until):
+            regions = s.pop("regions")
+            s.update({f"up_{r}": up for r, up in regions.items()})
+            s["events"] = "; ".join(by_second.get(s["second"], []))
+            rows.append(s)
+        return rows
+
+    def export(self, fmt, since=None, until=None):
+        """(bytes, media type) for fmt in csv, arrow (IPC stream) or parquet"""
+        rows = self.rows(since, until)
+        if fmt == "csv":
+            out = io.StringIO()
+            fields = list(rows[0]) if rows else ["second", "time", "writes", "events"]
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+            return out.getvalue().encode(), "text/csv"
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError(f"Install 'pyarrow' to export {fmt}")
+        table = pyarrow.Table.from_pylist(rows)
+        sink = pyarrow.BufferOutputStream()
+        if fmt == "parquet":
+            pyarrow.parquet.write_table(table, sink)
+            return sink.getvalue().to_pybytes(), "application/vnd.apache.parquet"
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), "application/vnd.apache.arrow.stream"
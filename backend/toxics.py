@@ -0,0 +1,100 @@
+"""Catalogue of Toxiproxy toxics and validation of toxic sets sent to the chaos API"""
+from toxiproxy_client import latency_toxic
+
+STREAMS = ("upstream", "downstream")
+
+# type -> attribute defaults (all integers) and what the toxic does
+CATALOGUE = {
+    "latency": {
+        "attributes": {"latency": 700, "jitter": 0},
+        "description": "Delay data by latency ms, +/- jitter ms",
+    },
+    "bandwidth": {
+        "attributes": {"rate": 100},
+        "description": "Limit the connection to rate KB/s",
+    },
+    "slow_close": {
+        "attributes": {"delay": 1000},
+        "description": "Delay closing the connection by delay ms",
+    },
+    "timeout": {
+        "attributes": {"timeout": 5000},
+        "description": "Stop all data and close the connection after timeout ms (0 = never close)",
+    },
+    "slicer": {
+        "attributes": {"average_size": 64, "size_variation": 32, "delay": 10},
+        "description": "Slice data into average_size +/- size_variation byte packets, delay us apart",
+    },
+    "limit_data": {
+        "attributes": {"bytes": 1048576},
+        "description": "Close the connection after bytes have been transmitted",
+    },
+    "reset_peer": {
+        "attributes": {"timeout": 0},
+        "description": "Reset the connection (TCP RST) after timeout ms",
+    },
+}
+
+
+# Names of the toxics the app sets itself (the brownout), so a custom toxic of the same
+# type and stream takes its place instead of stacking on top of it
+_BROWNOUT = latency_toxic(0)
+APP_NAMES = {(_BROWNOUT["type"], _BROWNOUT["stream"]): _BROWNOUT["name"]}
+
+
+class ToxicError(ValueError):
+    """Raised for a toxic set that names unknown types, streams or attributes"""
+
+
+def toxic_name(toxic_type, stream):
+    return APP_NAMES.get((toxic_type, stream), f"{toxic_type}_{stream}")
+
+
+def parse_toxic(spec):
+    """Toxiproxy toxic document from an API spec: type, stream, toxicity (0-100 %) and attributes"""
+    if not isinstance(spec, dict):
+        raise ToxicError("Each toxic must be an object")
+    toxic_type = spec.get("type")
+    if toxic_type not in CATALOGUE:
+        raise ToxicError(f"Unknown toxic type {toxic_type!r}, expected one of: {', '.join(CATALOGUE)}")
+    stream = spec.get("stream", "downstream")
+    if stream not in STREAMS:
+        raise ToxicError(f"Unknown stream {stream!r}, expected upstream or downstream")
+    try:
+        toxicity = float(spec.get("toxicity", 100))
+    except (TypeError, ValueError):
+        raise ToxicError(f"Invalid toxicity {spec.get('toxicity')!r}")
+    if not 0 <= toxicity <= 100:
+        raise ToxicError("toxicity is a percentage between 0 and 100")
+
+    defaults = CATALOGUE[toxic_type]["attributes"]
+    given = spec.get("attributes") or {}
+    if not isinstance(given, dict):
+        raise ToxicError(f"{toxic_type} attributes must be an object")
+    unknown = set(given) - set(defaults)
+    if unknown:
+        raise ToxicError(f"Unknown {toxic_type} attributes: {', '.join(sorted(unknown))}")
+    attributes = {}
+    for key, default in defaults.items():
+        try:
+            attributes[key] = max(0, int(given.get(key, default)))
+        except (TypeError, ValueError):
+            raise ToxicError(f"{toxic_type}.{key} must be an integer")
+
+    return {
+        "name": spec.get("name") or toxic_name(toxic_type, stream),
+        "type": toxic_type,
+        "stream": stream,
+        "toxicity": toxicity / 100,
+        "attributes": attributes,
+    }
+
+
+def parse_toxics(specs):
+    if not isinstance(specs, list):
+        raise ToxicError("'toxics' must be a list")
+    toxics = [parse_toxic(spec) for spec in specs]
+    names = [t["name"] for t in toxics]
+    if len(set(names)) != len(names):
+        raise ToxicError("Toxic names must be unique; give repeated type/stream pairs a 'name'")
+    return toxics
@@ -0,0 +1,106 @@
+"""Async Toxiproxy REST client with keep-alive pooling and concurrent fan-out"""
+import asyncio
+import os
+
+import httpx
+
+import metrics
+
+TOXIPROXY_TIMEOUT = float(os.getenv("TOXIPROXY_TIMEOUT", "3"))
+TOXIPROXY_MAX_CONNECTIONS = int(os.getenv("TOXIPROXY_MAX_CONNECTIONS", "20"))
+
+
+class ProxyNotFound(Exception):
+    """Raised when a proxy name is unknown to a Toxiproxy API"""
+
+    def __init__(self, api, name):
+        super().__init__(f"Proxy {name} not found at {api}")
+        self.api = api
+        self.name = name
+
+
+def latency_toxic(ms):
+    return {
+        "name": "latency", "type": "latency", "stream": "downstream",
+        "attributes": {"latency": int(ms), "jitter": int(ms / 3)}
+    }
+
+
+class ToxiproxyClient:
+    """Pooled async client shared by every request handled in one worker.
+
+    The underlying httpx client is created lazily on first use so the gunicorn
+    master (``preload_app=True``) never owns sockets that forked workers would
+    inherit.
+    """
+
+    def __init__(self, timeout=TOXIPROXY_TIMEOUT, max_connections=TOXIPROXY_MAX_CONNECTIONS):
+        self.timeout = timeout
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=30,
+        )
+        self._client = None
+        self._pid = None
+
+    def _http(self):
+        if self._client is None or self._client.is_closed or self._pid != os.getpid():
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self._limits)
+            self._pid = os.getpid()
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._pid == os.getpid():
+            await self._client.aclose()
+        self._client = None
+
+    async def _request(self, op, method, api, path, timeout=None, **kwargs):
+        """One REST call, timed per API and client operation"""
+        with metrics.toxiproxy_call(api, op):
+            return await self._http().request(method, f"{api}{path}", timeout=timeout or self.timeout, **kwargs)
+
+    async def list_proxies(self, api, timeout=None):
+        r = await self._request("list_proxies", "GET", api, "/proxies", timeout)
+        r.raise_for_status()
+        data = r.json()
+        # Toxiproxy returns a dict, not an array
+        if isinstance(data, dict):
+            return data
+        return {p["name"]: p for p in data}
+
+    async def list_proxies_many(self, apis, timeout=None):
+        """Fetch proxies from several APIs at once; failures are returned, not raised"""
+        results = await asyncio.gather(
+            *(self.list_proxies(api, timeout) for api in apis), return_exceptions=True
+        )
+        return dict(zip(apis, results))
+
+    async def set_enabled(self, api, name, enabled: bool, timeout=None):
+        r = await self._request("set_enabled", "POST", api, f"/proxies/{name}", timeout, json={"enabled": enabled})
+        if r.status_code == 404:
+            raise ProxyNotFound(api, name)
+        r.raise_for_status()
+
+    async def get_proxy(self, api, name, timeout=None):
+        r = await self._request("get_proxy", "GET", api, f"/proxies/{name}", timeout)
+        if r.status_code == 404:
+            raise ProxyNotFound(api, name)
+        r.raise_for_status()
+        return r.json()
+
+    async def list_toxics(self, api, name, timeout=None):
+        r = await self._request("list_toxics", "GET", api, f"/proxies/{name}/toxics", timeout)
+        if r.status_code != 200:
+            return []
+        return r.json()
+
+    async def add_toxic(self, api, name, toxic, timeout=None):
+        return await self._request("add_toxic", "POST", api, f"/proxies/{name}/toxics", timeout, json=toxic)
+
+    async def update_toxic(self, api, name, toxic_name, toxic, timeout=None):
+        """Change a toxic's attributes/toxicity in place (no window without the toxic)"""
+        return await self._request("update_toxic", "POST", api, f"/proxies/{name}/toxics/{toxic_name}", timeout, json=toxic)
+
+    async def delete_toxic(self, api, name, toxic_name, timeout=None):
+        return await self._request("delete_toxic", "DELETE", api, f"/proxies/{name}/toxics/{toxic_name}", timeout)
@@ -0,0 +1,292 @@
+"""Time-to-recover measurement for injected faults.
+
+A fault starts a measurement in the worker that injected it. From then on
+a write+read probe is launched every ``TTR_PROBE_INTERVAL`` (10 ms) on a
+small set of dedicated connections. Several attempts can be in flight at
+once, so a probe hanging on a dead gateway never stops new attempts, and
+recovery is seen within one interval. Three numbers come out of the probe
+records:
+
+- unavailability window: the longest stretch after the fault with no
+  successful write completing
+- time to first write: from the fault to the first successful write that
+  started after it
+- time to baseline: from the fault to the start of the first run of
+  ``TTR_STABLE_PROBES`` successful probes all within the baseline latency bound
+
+The baseline is the median probe latency measured before any fault, by a
+slow (1/s) probe that runs only in the leader worker. Results are kept in a
+capped shared history, so any worker can answer for them.
+"""
+import asyncio
+import os
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import psycopg2
+
+import metrics
+import shared_state
+
+TTR_PROBE_INTERVAL = float(os.getenv("TTR_PROBE_INTERVAL", "0.01"))
+TTR_PROBE_CONCURRENCY = int(os.getenv("TTR_PROBE_CONCURRENCY", "8"))
+TTR_PROBE_TIMEOUT_MS = int(os.getenv("TTR_PROBE_TIMEOUT_MS", "2000"))
+TTR_MAX_SECONDS = float(os.getenv("TTR_MAX_SECONDS", "120"))
+TTR_STABLE_PROBES = int(os.getenv("TTR_STABLE_PROBES", "20"))
+# Probe latency counts as back to baseline within factor * baseline + slack
+TTR_BASELINE_FACTOR = float(os.getenv("TTR_BASELINE_FACTOR", "1.5"))
+TTR_BASELINE_SLACK_MS = float(os.getenv("TTR_BASELINE_SLACK_MS", "2"))
+TTR_BASELINE_INTERVAL = float(os.getenv("TTR_BASELINE_INTERVAL", "1.0"))
+TTR_HISTORY = int(os.getenv("TTR_HISTORY", "100"))
+
+HISTORY_FILE = "ttr-history.json"
+HISTORY_LOCK = "ttr-history.lock"
+BASELINE_FILE = "ttr-baseline.json"
+
+PROBE_TABLE = "defaultdb.chaos_probe"
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat() if ts is not None else None
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class Prober:
+    """Write+read probes on dedicated autocommit connections, one per executor thread"""
+
+    def __init__(self, connect_kwargs, concurrency=TTR_PROBE_CONCURRENCY, timeout_ms=TTR_PROBE_TIMEOUT_MS):
+        self.connect_kwargs = {**connect_kwargs, "connect_timeout": max(1, timeout_ms // 1000)}
+        self.concurrency = concurrency
+        self.timeout_ms = timeout_ms
+        self._local = threading.local()
+        self._executor = None
+        self._pid = None
+
+    def executor(self):
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="ttr-probe")
+            self._pid = os.getpid()
+        return self._executor
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn.closed:
+            conn = psycopg2.connect(cursor_factory=metrics.TimedCursor, **self.connect_kwargs)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"SET statement_timeout = {self.timeout_ms}")
+            self._local.conn = conn
+            # Each thread writes its own row so probes never contend with each other
+            self._local.row = hash((os.getpid(), threading.get_ident())) % 1_000_000
+        return conn
+
+    def ensure_table(self):
+        """Create the probe table (normally already made by init.sql); run once per worker at startup"""
+        with self._conn().cursor() as cur:
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {PROBE_TABLE} (id INT PRIMARY KEY, at TIMESTAMPTZ NOT NULL)")
+
+    def attempt(self):
+        """(started, ended, ok) in wall-clock seconds for one write followed by a read"""
+        started = time.time()
+        try:
+            conn = self._conn()
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT INTO {PROBE_TABLE} (id, at) VALUES (%s, now()) "
+                    "ON CONFLICT (id) DO UPDATE SET at = excluded.at",
+                    (self._local.row,)
+                )
+                cur.execute(f"SELECT at FROM {PROBE_TABLE} WHERE id = %s", (self._local.row,))
+                cur.fetchone()
+            ok = True
+        except Exception:
+            ok = False
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                self._local.conn = None
+        return started, time.time(), ok
+
+
+def analyze(probes, fault_at, baseline_ms):
+    """Unavailability window, time to first write and time to baseline from probe records"""
+    bound_ms = baseline_ms * TTR_BASELINE_FACTOR + TTR_BASELINE_SLACK_MS if baseline_ms else None
+    successes = sorted((end, start) for start, end, ok in probes if ok and end >= fault_at)
+
+    # Longest gap between successful completions, counting the fault itself as the last good moment
+    gap_start, gap_end, last = fault_at, None, fault_at
+    longest = 0.0
+    for end, _ in successes:
+        if end - last > longest:
+            longest, gap_start, gap_end = end - last, last, end
+        last = end
+
+    first_write = next((end for end, start in successes if start >= fault_at), None)
+
+    baseline_at = None
+    if bound_ms is not None:
+        run = []
+        for start, end, ok in sorted(p for p in probes if p[0] >= fault_at):
+            if ok and (end - start) * 1000 <= bound_ms:
+                run.append(start)
+                if len(run) >= TTR_STABLE_PROBES:
+                    baseline_at = run[0]
+                    break
+            else:
+                run = []
+
+    return {
+        "unavailable_ms": _ms(longest) if gap_end is not None else None,
+        "unavailable_from": _iso(gap_start) if gap_end is not None else None,
+        "unavailable_until": _iso(gap_end),
+        "first_write_ms": _ms(first_write - fault_at) if first_write is not None else None,
+        "baseline_ms": baseline_ms,
+        "baseline_bound_ms": round(bound_ms, 2) if bound_ms is not None else None,
+        "back_to_baseline_ms": _ms(baseline_at - fault_at) if baseline_at is not None else None,
+        "probes": len(probes),
+        "probe_failures": sum(1 for p in probes if not p[2]),
+    }
+
+
+class Measurement:
+    def __init__(self, tracker, action, region):
+        self.tracker = tracker
+        self.id = uuid.uuid4().hex[:12]
+        self.action = action
+        self.region = region
+        self.fault_at = None
+        self._task = None
+
+    def fault(self, at):
+        """Set the moment the fault took effect; probing has already started by then"""
+        self.fault_at = at
+
+    def cancel(self):
+        """Drop a measurement whose fault never happened"""
+        if self._task is not None:
+            self._task.cancel()
+
+
+class TTRTracker:
+    def __init__(self, prober):
+        self.prober = prober
+        self._leader = shared_state.FileLock("ttr-baseline.leader.lock")
+        self._running = set()
+
+    def baseline(self):
+        data = shared_state.read_json(BASELINE_FILE)
+        return data["p50_ms"] if data else None
+
+    async def run_baseline(self):
+        """Background loop: the leader keeps a rolling median of probe latency while no fault runs"""
+        loop = asyncio.get_running_loop()
+        recent = []
+
+        async def sample():
+            nonlocal recent
+            if self._measuring():
+                return
+            start, end, ok = await loop.run_in_executor(self.prober.executor(), self.prober.attempt)
+            if not ok:
+                return
+            recent = (recent + [(end - start) * 1000])[-30:]
+            shared_state.write_json(BASELINE_FILE, {
+                "p50_ms": round(statistics.median(recent), 3), "samples": len(recent), "at": time.time()
+            })
+
+        await shared_state.lead(self._leader, sample, lambda started: TTR_BASELINE_INTERVAL)
+
+    def _measuring(self):
+        """Whether any worker is measuring; records left behind by a dead worker expire"""
+        cutoff = time.time() - TTR_MAX_SECONDS - 60
+        return any(r["started_ts"] > cutoff for r in self.history(state="measuring"))
+
+    def start(self, action, region):
+        m = Measurement(self, action, region)
+        m._task = asyncio.create_task(self._measure(m))
+        self._running.add(m._task)
+        m._task.add_done_callback(self._running.discard)
+        return m
+
+    async def drain(self, timeout):
+        """Let measurements in this worker reach a result for up to ``timeout`` seconds"""
+        if self._running:
+            await asyncio.wait(set(self._running), timeout=timeout)
+
+    def cancel_all(self):
+        for task in list(self._running):
+            task.cancel()
+
+    async def _measure(self, m):
+        loop = asyncio.get_running_loop()
+        executor = self.prober.executor()
+        baseline_ms = self.baseline()
+        probes, in_flight = [], set()
+        record = {
+            "id": m.id, "action": m.action, "region": m.region, "state": "measuring",
+            "started_ts": time.time(), "fault_at": None, "finished_at": None, "status_url": f"/api/ttr/{m.id}"
+        }
+        self._save(record)
+
+        def done(fut):
+            in_flight.discard(fut)
+            if not fut.cancelled() and fut.exception() is None:
+                probes.append(fut.result())
+
+        try:
+            deadline = None
+            next_launch = loop.time()
+            tick = 0
+            while True:
+                tick += 1
+                # Probe records carry their own timestamps, so analysing every tenth tick loses no accuracy
+                if m.fault_at is not None and tick % 10 == 0:
+                    if deadline is None:
+                        deadline = loop.time() + TTR_MAX_SECONDS
+                        record["fault_at"] = _iso(m.fault_at)
+                        self._save(record)
+                    result = analyze(probes, m.fault_at, baseline_ms)
+                    if result["first_write_ms"] is not None and (
+                        result["back_to_baseline_ms"] is not None or baseline_ms is None
+                    ):
+                        record.update(result, state="completed")
+                        break
+                    if loop.time() > deadline:
+                        record.update(result, state="timeout")
+                        break
+                if len(in_flight) < self.prober.concurrency:
+                    fut = loop.run_in_executor(executor, self.prober.attempt)
+                    in_flight.add(fut)
+                    fut.add_done_callback(done)
+                next_launch += TTR_PROBE_INTERVAL
+                await asyncio.sleep(max(0.0, next_launch - loop.time()))
+        except asyncio.CancelledError:
+            record["state"] = "cancelled"
+            raise
+        finally:
+            record["finished_at"] = _iso(time.time())
+            self._save(record)
+
+    def _save(self, record):
+        with shared_state.FileLock(HISTORY_LOCK):
+            history = [r for r in shared_state.read_json(HISTORY_FILE, []) if r["id"] != record["id"]]
+            history.append(dict(record))
+            shared_state.write_json(HISTORY_FILE, history[-TTR_HISTORY:])
+
+    def get(self, measurement_id):
+        return next((r for r in shared_state.read_json(HISTORY_FILE, []) if r["id"] == measurement_id), None)
+
+    def history(self, limit=None, state=None):
+        """Most recent first"""
+        records = [r for r in reversed(shared_state.read_json(HISTORY_FILE, [])) if state is None or r["state"] == state]
+        return records[:limit] if limit else records
@@ -5,6 +5,7 @@ Demonstrates online schema changes, load testing, and changefeeds
 Consolidated script for all operational features
 """
 
+import asyncio
 import psycopg2
 import sys
 import time
@@ -14,6 +15,11 @@ import random
 from datetime import datetime
 from psycopg2.extras import RealDictCursor
 
+import load_histogram
+from load_engine import LoadEngine, new_stats, parse_profile
+from load_pool import LoadPool
+from load_workloads import DISTRIBUTIONS, OPERATIONS, WORKLOADS, Workload
+
 try:
     from rich.console import Console
     from rich.table import Table
@@ -29,16 +35,9 @@ except ImportError:
 CONN_STR = "postgresql://root@localhost:26257/defaultdb?sslmode=disable"
 console = Console() if RICH_AVAILABLE else None
 
-# Global state for load testing
-load_test_running = False
-load_test_stats = {
-    'total_writes': 0,
-    'successful_writes': 0,
-    'failed_writes': 0,
-    'latencies': [],
-    'errors': []
-}
-stats_lock = threading.Lock()
+load_test_stats = new_stats()
+# Sliding window (seconds) shown next to whole-run latency percentiles
+LATENCY_WINDOW = 10
 
 def get_connection():
     """Get database connection with retry"""
@@ -235,165 +234,179 @@ def demo_schema_change():
 # LOAD TESTING
 # =============================================================================
 
-def load_test_worker():
-    """Background worker for load testing"""
-    global load_test_running
-    
-    while load_test_running:
-        start = time.time()
-        try:
-            conn = get_connection()
-            cursor = conn.cursor()
-            
-            # Insert with random amount
-            amount = random.randint(1, 1000)
-            cursor.execute(
-                "INSERT INTO demo_transactions (ts, amount) VALUES (now(), %s)",
-                (amount,)
-            )
-            conn.commit()
-            
-            latency = (time.time() - start) * 1000  # ms
-            
-            with stats_lock:
-                load_test_stats['total_writes'] += 1
-                load_test_stats['successful_writes'] += 1
-                load_test_stats['latencies'].append(latency)
-                
-                # Keep only last 1000 latencies for stats
-                if len(load_test_stats['latencies']) > 1000:
-                    load_test_stats['latencies'].pop(0)
-            
-            cursor.close()
-            conn.close()
-            
-        except Exception as e:
-            with stats_lock:
-                load_test_stats['total_writes'] += 1
-                load_test_stats['failed_writes'] += 1
-                load_test_stats['errors'].append(str(e))
-                if len(load_test_stats['errors']) > 100:
-                    load_test_stats['errors'].pop(0)
-        
-        # Sleep to control TPS (adjust for desired rate)
-        time.sleep(0.01)  # ~100 TPS per thread
+def format_ms(value):
+    return f"{value:.2f}ms" if value is not None else "-"
+
+def inserts_only(workload):
+    return set(workload.mix) == {"insert"}
+
+def load_test_table(elapsed, engine):
+    """Live metrics table for the load test"""
+    stats = load_test_stats
+    total = stats['total_writes']
+    success = stats['successful_writes']
+    failed = stats['failed_writes']
+    
+    qps = total / elapsed if elapsed > 0 else 0
+    success_rate = (success / total * 100) if total > 0 else 0
+    
+    run = stats['latency'].total.percentiles()
+    window = stats['latency'].window(LATENCY_WINDOW).percentiles()
+    
+    table = Table(title=f"Load Test Metrics (Elapsed: {elapsed:.1f}s)", box=box.HEAVY_EDGE)
+    table.add_column("Metric", style="cyan")
+    table.add_column("Value", style="green", justify="right")
+    
+    table.add_row("QPS (Queries/sec)", f"{qps:.1f}")
+    if stats['target_rate'] is not None:
+        table.add_row("Target Rate (ops/s)", f"{stats['target_rate']:.1f}")
+        table.add_row("Backlog (due, not sent)", f"[red]{engine.backlog}[/red]" if engine.backlog else "0")
+    if inserts_only(engine.workload):
+        table.add_row("Total Writes", str(total))
+    else:
+        table.add_row("Total Operations", str(total))
+        table.add_row("Mix", " / ".join(f"{op} {stats['ops'][op]}" for op in OPERATIONS if op in engine.workload.mix))
+    table.add_row("Successful", f"{success} ({success_rate:.1f}%)")
+    table.add_row("Failed", f"[red]{failed}[/red]" if failed > 0 else str(failed))
+    table.add_row("Open Connections", f"{engine.connected}/{engine.concurrency}")
+    table.add_row("", "")
+    # Open loop: latency includes time spent queued behind a stalled cluster
+    table.add_row("[bold]Latency Metrics[/bold]", "from intended start" if engine.profile else "")
+    table.add_row("", f"run │ last {LATENCY_WINDOW}s")
+    for key in ["p50", "p95", "p99", "p99.9", "max"]:
+        table.add_row(key + (" (median)" if key == "p50" else ""), f"{format_ms(run[key])} │ {format_ms(window[key])}")
+    return table
 
-def calculate_percentile(latencies, percentile):
-    """Calculate percentile from latency list"""
-    if not latencies:
-        return 0
-    sorted_lat = sorted(latencies)
-    index = int(len(sorted_lat) * percentile / 100)
-    return sorted_lat[min(index, len(sorted_lat) - 1)]
+def demo_load_test(duration=30, concurrency=None, rate=None, profile="constant", save_latency=None,
+                   compare_latency=None, processes=1, workload=None):
+    """Run load test with real-time metrics; ``rate`` (ops/s) switches to an open-loop schedule
 
-def demo_load_test(duration=30, num_threads=10):
-    """Run load test with real-time metrics"""
+    ``workload`` (a ``load_workloads.Workload``) defaults to single-row inserts.
+    ``processes`` > 1 splits the connections (and rate) over that many processes, one core each.
+
+    ``save_latency`` writes the run's latency histogram to a JSON file; ``compare_latency`` prints the
+    percentiles of such a file next to this run's.
+    """
     ensure_demo_table()
-    print_header(
-        f"Load Test ({duration}s)",
-        f"Sustained write workload with {num_threads} concurrent threads"
-    )
-    
-    global load_test_running
-    load_test_running = True
-    
-    # Reset stats
-    with stats_lock:
-        load_test_stats.update({
-            'total_writes': 0,
-            'successful_writes': 0,
-            'failed_writes': 0,
-            'latencies': [],
-            'errors': []
-        })
-    
-    # Start worker threads
-    threads = []
-    for i in range(num_threads):
-        t = threading.Thread(target=load_test_worker, daemon=True)
-        t.start()
-        threads.append(t)
-    
-    if RICH_AVAILABLE:
-        console.print(f"[green]✓[/green] Started {num_threads} worker threads\n")
+    workload = workload or Workload.preset("insert")
+    conn = get_connection()
+    try:
+        workload.prepare(conn)
+    finally:
+        conn.close()
+    if concurrency is None:
+        # An open loop needs enough connections to absorb the rate at failover latencies
+        concurrency = 100 if rate else 10
+    if rate:
+        subtitle = f"Open loop: {profile} profile at {rate:g} ops/s over {concurrency} persistent connections"
+    elif inserts_only(workload):
+        subtitle = f"Sustained write workload with {concurrency} concurrent operations on persistent connections"
     else:
-        print(f"✓ Started {num_threads} worker threads\n")
-    
-    # Monitor for duration
-    start_time = time.time()
+        subtitle = f"Sustained workload with {concurrency} concurrent operations on persistent connections"
+    if not inserts_only(workload) or workload.row_size:
+        subtitle += f"\nWorkload: {workload.describe()}" + (f" over {len(workload.keys)} keys" if workload.keys else "")
+    print_header(f"Load Test ({duration}s)", subtitle)
+    
+    load_test_stats.update(new_stats())
+    if processes > 1:
+        engine = LoadPool(CONN_STR, concurrency, load_test_stats, processes, rate=rate, profile=profile,
+                          workload=workload)
+        run = engine.run
+    else:
+        engine = LoadEngine(CONN_STR, concurrency, load_test_stats,
+                            profile=parse_profile(profile, rate, duration) if rate else None, workload=workload)
+        run = lambda *args, **kwargs: asyncio.run(engine.run(*args, **kwargs))
+    workers = f"{concurrency} async workers" + (f" in {engine.processes} processes" if processes > 1 else "")
     
     if RICH_AVAILABLE:
+        console.print(f"[green]✓[/green] Starting {workers} (Ctrl-C stops cleanly)\n")
         with Live(console=console, refresh_per_second=2) as live:
-            while time.time() - start_time < duration:
-                elapsed = time.time() - start_time
-                
-                with stats_lock:
-                    total = load_test_stats['total_writes']
-                    success = load_test_stats['successful_writes']
-                    failed = load_test_stats['failed_writes']
-                    latencies = load_test_stats['latencies'].copy()
-                
-                qps = total / elapsed if elapsed > 0 else 0
-                success_rate = (success / total * 100) if total > 0 else 0
-                
-                p50 = calculate_percentile(latencies, 50)
-                p95 = calculate_percentile(latencies, 95)
-                p99 = calculate_percentile(latencies, 99)
-                
-                # Build metrics table
-                table = Table(title=f"Load Test Metrics (Elapsed: {elapsed:.1f}s)", box=box.HEAVY_EDGE)
-                table.add_column("Metric", style="cyan")
-                table.add_column("Value", style="green", justify="right")
-                
-                table.add_row("QPS (Queries/sec)", f"{qps:.1f}")
-                table.add_row("Total Writes", str(total))
-                table.add_row("Successful", f"{success} ({success_rate:.1f}%)")
-                table.add_row("Failed", f"[red]{failed}[/red]" if failed > 0 else str(failed))
-                table.add_row("", "")
-                table.add_row("[bold]Latency Metrics[/bold]", "")
-                table.add_row("p50 (median)", f"{p50:.2f}ms")
-                table.add_row("p95", f"{p95:.2f}ms")
-                table.add_row("p99", f"{p99:.2f}ms")
-                
-                live.update(table)
-                time.sleep(0.5)
+            elapsed = run(duration, on_tick=lambda e: live.update(load_test_table(e, engine)))
+            live.update(load_test_table(elapsed, engine))
     else:
-        while time.time() - start_time < duration:
-            elapsed = time.time() - start_time
-            with stats_lock:
-                total = load_test_stats['total_writes']
-                success = load_test_stats['successful_writes']
+        print(f"✓ Starting {workers} (Ctrl-C stops cleanly)\n")
+        
+        def report(elapsed):
+            total = load_test_stats['total_writes']
             qps = total / elapsed if elapsed > 0 else 0
-            print(f"[{elapsed:.1f}s] QPS: {qps:.1f} | Total: {total} | Success: {success}")
-            time.sleep(2)
-    
-    # Stop workers
-    load_test_running = False
-    for t in threads:
-        t.join(timeout=2)
+            print(f"[{elapsed:.1f}s] QPS: {qps:.1f} | Total: {total} | Success: {load_test_stats['successful_writes']}")
+        
+        elapsed = run(duration, on_tick=report, tick=2)
     
     # Final stats
-    with stats_lock:
-        total = load_test_stats['total_writes']
-        success = load_test_stats['successful_writes']
-        failed = load_test_stats['failed_writes']
-        latencies = load_test_stats['latencies']
+    total = load_test_stats['total_writes']
+    success = load_test_stats['successful_writes']
+    failed = load_test_stats['failed_writes']
+    latency = load_test_stats['latency'].total
+    summary = latency.percentiles()
     
-    elapsed = time.time() - start_time
-    qps = total / elapsed
+    qps = total / elapsed if elapsed > 0 else 0
+    success_rate = success / total * 100 if total else 0
     
     if RICH_AVAILABLE:
         console.print(f"\n[bold green]Load Test Complete![/bold green]")
         console.print(f"  • Duration: {elapsed:.1f}s")
         console.print(f"  • Average QPS: {qps:.1f}")
-        console.print(f"  • Total Writes: {total}")
-        console.print(f"  • Success Rate: {success/total*100:.2f}%")
-        console.print(f"  • p99 Latency: {calculate_percentile(latencies, 99):.2f}ms")
+        console.print(f"  • Total {'Writes' if inserts_only(workload) else 'Operations'}: {total}")
+        console.print(f"  • Success Rate: {success_rate:.2f}%")
+        console.print(f"  • Latency: p50 {format_ms(summary['p50'])}, p99 {format_ms(summary['p99'])}, "
+                      f"p99.9 {format_ms(summary['p99.9'])}, max {format_ms(summary['max'])}")
+        for op, line in op_summaries(workload):
+            console.print(f"    - {op}: {line}")
+        if load_test_stats['unsent']:
+            console.print(f"  • [red]Unsent at stop (backlog): {load_test_stats['unsent']}[/red]")
     else:
         print(f"\nLoad Test Complete!")
         print(f"  Duration: {elapsed:.1f}s")
         print(f"  Average QPS: {qps:.1f}")
         print(f"  Total: {total}, Success: {success}, Failed: {failed}")
+        print(f"  Latency: p50 {format_ms(summary['p50'])}, p99 {format_ms(summary['p99'])}, "
+              f"p99.9 {format_ms(summary['p99.9'])}, max {format_ms(summary['max'])}")
+        for op, line in op_summaries(workload):
+            print(f"    {op}: {line}")
+    
+    if save_latency:
+        load_histogram.save(save_latency, latency, finished=datetime.now().isoformat(timespec="seconds"),
+                            duration=round(elapsed, 1), concurrency=concurrency, processes=processes,
+                            workload=workload.describe(), rate=rate, profile=profile if rate else None,
+                            total=total, failed=failed)
+        print(f"\nLatency histogram saved to {save_latency}")
+    if compare_latency:
+        compare_latency_runs(compare_latency, summary)
+
+def op_summaries(workload):
+    """(operation, "count, p50, p99") for each operation of a mixed workload"""
+    if len(workload.mix) < 2:
+        return []
+    lines = []
+    for op in OPERATIONS:
+        if op in workload.mix:
+            pct = load_test_stats['op_latency'][op].percentiles()
+            lines.append((op, f"{load_test_stats['ops'][op]} ops, p50 {format_ms(pct['p50'])}, "
+                              f"p99 {format_ms(pct['p99'])}"))
+    return lines
+
+def compare_latency_runs(path, current):
+    """Print a saved run's latency percentiles next to ``current``"""
+    baseline, meta = load_histogram.load(path)
+    baseline = baseline.percentiles()
+    keys = ["count", "p50", "p95", "p99", "p99.9", "max"]
+    
+    def cell(summary, key):
+        return str(summary[key]) if key == "count" else format_ms(summary[key])
+    
+    if RICH_AVAILABLE:
+        table = Table(title=f"Latency vs {path} ({meta.get('finished', 'unknown')})", box=box.HEAVY_EDGE)
+        table.add_column("Metric", style="cyan")
+        table.add_column("Baseline", justify="right")
+        table.add_column("This run", style="green", justify="right")
+        for key in keys:
+            table.add_row(key, cell(baseline, key), cell(current, key))
+        console.print(table)
+    else:
+        print(f"\nLatency vs {path}:")
+        for key in keys:
+            print(f"  {key:>6}: {cell(baseline, key):>12} -> {cell(current, key)}")
 
 # =============================================================================
 # CHANGEFEEDS (CDC)
@@ -484,7 +497,11 @@ def main():
         epilog="""
 Examples:
   %(prog)s --schema-change          # Online DDL demo
-  %(prog)s --load-test --duration 60 --threads 20  # 60s load test
+  %(prog)s --load-test --duration 60 --concurrency 500  # 60s load test
+  %(prog)s --load-test --rate 2000 --profile spike:8000@20s+5s  # Open loop with a spike
+  %(prog)s --load-test --processes 8 --concurrency 800 --rate 20000  # Past one core
+  %(prog)s --load-test --workload hot-reads --row-size 512  # 80%% point reads on a hot key set
+  %(prog)s --load-test --save-latency before.json  # Keep the latency histogram for comparison
   %(prog)s --changefeed              # CDC overview
   %(prog)s --all                     # Run all demos
         """
@@ -496,26 +513,66 @@ Examples:
                        help='Run load test')
     parser.add_argument('--duration', type=int, default=30,
                        help='Load test duration (seconds)')
-    parser.add_argument('--threads', type=int, default=10,
-                       help='Number of concurrent threads for load test')
+    parser.add_argument('--concurrency', '--threads', dest='concurrency', type=int, default=None,
+                       help='Concurrent in-flight operations for load test, each on its own persistent connection '
+                            '(--threads is the old name; default 10, or 100 with --rate)')
+    parser.add_argument('--rate', type=float, default=None,
+                       help='Open-loop load test at this many ops/s; latency is measured from each '
+                            "operation's intended start")
+    parser.add_argument('--profile', default=None,
+                       help='Rate profile for --rate (default constant): constant, ramp[:FROM], step:R1,R2,..., '
+                            'spike:PEAK@AT+LEN')
+    parser.add_argument('--processes', type=int, default=1,
+                       help='Spread the load test over this many processes (one core each); '
+                            '--concurrency and --rate are totals')
+    parser.add_argument('--workload', default='insert', choices=list(WORKLOADS),
+                       help='Load test workload preset (default: insert)')
+    parser.add_argument('--mix', default=None,
+                       help="Override the preset's operation mix, e.g. read=80,update=15,insert=5 "
+                            f"(operations: {', '.join(OPERATIONS)})")
+    parser.add_argument('--distribution', default=None, choices=DISTRIBUTIONS,
+                       help="Override the preset's key distribution over existing ids")
+    parser.add_argument('--row-size', type=int, default=None,
+                       help='Payload bytes written by inserts and updates (adds a payload column)')
+    parser.add_argument('--scan-length', type=int, default=None,
+                       help='Longest scan, in rows (each scan reads 1..N rows)')
+    parser.add_argument('--save-latency', metavar='FILE',
+                       help='Save the load test latency histogram to a JSON file')
+    parser.add_argument('--compare-latency', metavar='FILE',
+                       help='Compare load test latency percentiles with a saved histogram')
     parser.add_argument('--changefeed', action='store_true',
                        help='Demo changefeed (CDC) capability')
     parser.add_argument('--all', action='store_true',
                        help='Run all operational demos')
     
     args = parser.parse_args()
+    if args.profile is not None and args.rate is None:
+        parser.error("--profile shapes an open-loop run; it needs --rate")
+    args.profile = args.profile or 'constant'
+    if args.rate is not None:
+        try:
+            parse_profile(args.profile, args.rate, args.duration)
+        except ValueError as e:
+            parser.error(str(e))
+    try:
+        workload = Workload.preset(args.workload, mix=args.mix, distribution=args.distribution,
+                                   row_size=args.row_size, scan_length=args.scan_length)
+    except ValueError as e:
+        parser.error(str(e))
     
     try:
         if args.all:
             demo_schema_change()
             print("\n")
-            demo_load_test(duration=30, num_threads=args.threads)
+            demo_load_test(duration=30, concurrency=args.concurrency)
             print("\n")
             demo_changefeed()
         elif args.schema_change:
             demo_schema_change()
         elif args.load_test:
-            demo_load_test(duration=args.duration, num_threads=args.threads)
+            demo_load_test(duration=args.duration, concurrency=args.concurrency, rate=args.rate, profile=args.profile,
+                           save_latency=args.save_latency, compare_latency=args.compare_latency,
+                           processes=args.processes, workload=workload)
         elif args.changefeed:
             demo_changefeed()
         else:
@@ -523,7 +580,6 @@ Examples:
     
     except KeyboardInterrupt:
         print("\n\nDemo interrupted by user")
-        load_test_running = False
         sys.exit(0)
     except Exception as e:
         print(f"\n❌ Error: {e}")
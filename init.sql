@@ -17,6 +17,12 @@ CREATE TABLE IF NOT EXISTS defaultdb.demo_transactions (
   amount INT NOT NULL
 );
 
+-- Write/read probe rows used by the backend to measure time-to-recover after a fault
+CREATE TABLE IF NOT EXISTS defaultdb.chaos_probe (
+  id INT PRIMARY KEY,
+  at TIMESTAMPTZ NOT NULL
+);
+
 -- Note: Multi-region database setup
 -- Uncomment these if you need full multi-region features:
 
@@ -0,0 +1,271 @@
+"""Asyncio load engine behind ``demo_operations.py --load-test``.
+
+Each worker task keeps one persistent psycopg 3 async connection. The
+process therefore holds as many statements in flight as there are workers
+(thousands if asked), and latencies measure CockroachDB rather than
+connection setup. ``stop()`` (also bound to Ctrl-C) lets in-flight
+operations finish before the connections are closed. What each operation
+does comes from a workload (``load_workloads``). Latencies go into a
+fixed-size histogram (``load_histogram``) covering the whole run and the
+last minute.
+
+Closed loop (the default): each worker runs operations back to back.
+
+Open loop (given a rate profile): a dispatcher puts every operation's
+intended start time on a queue, following the profile's rate. Workers
+take operations off the queue. Latency is measured from the intended
+start, not from when a worker got to the operation. A stalled cluster
+therefore shows up as queueing delay in the latencies, instead of the
+generator silently sending less (coordinated omission).
+"""
+import asyncio
+import signal
+import time
+
+from load_histogram import Histogram, LatencyRecorder
+from load_workloads import OPERATIONS, Workload
+
+try:
+    import psycopg
+    PSYCOPG_AVAILABLE = True
+except ImportError:
+    PSYCOPG_AVAILABLE = False
+
+CONNECT_TIMEOUT = 5
+# Connections opened at once; thousands of simultaneous handshakes overwhelm HAProxy and the gateways
+CONNECT_PARALLELISM = 50
+# Pause before a worker reconnects after its connection broke (e.g. its gateway was killed)
+RECONNECT_DELAY = 0.1
+# Schedule granularity while a profile's rate is zero
+IDLE_STEP = 0.01
+MAX_ERRORS = 100
+
+
+PROFILES = ("constant", "ramp", "step", "spike")
+
+
+def new_stats():
+    # total_writes counts every operation; the name predates read workloads
+    return {
+        'total_writes': 0, 'successful_writes': 0, 'failed_writes': 0, 'connect_failures': 0,
+        'latency': LatencyRecorder(), 'errors': [], 'target_rate': None, 'unsent': 0,
+        'ops': {op: 0 for op in OPERATIONS}, 'op_latency': {op: Histogram() for op in OPERATIONS},
+    }
+
+
+def _seconds(value):
+    value = value.strip()
+    return float(value[:-1]) if value.endswith("s") else float(value)
+
+
+def parse_profile(spec, rate, duration):
+    """Rate (ops/s) as a function of seconds since the start, from a profile spec.
+
+    constant            --rate throughout
+    ramp[:FROM]         linear from FROM (default 0) up to --rate over the run
+    step:R1,R2,...      equal-length steps at each rate
+    spike:PEAK@AT+LEN   --rate, except PEAK for LEN seconds from AT (e.g. spike:5000@20s+5s)
+    """
+    kind, _, args = (spec or "constant").partition(":")
+    try:
+        if kind == "constant" and not args:
+            return lambda t: rate
+        if kind == "ramp":
+            low = float(args) if args else 0.0
+            return lambda t: low + (rate - low) * min(1.0, t / duration)
+        if kind == "step" and args:
+            rates = [float(r) for r in args.split(",")]
+            return lambda t: rates[min(len(rates) - 1, int(t / duration * len(rates)))]
+        if kind == "spike" and args:
+            peak, _, window = args.partition("@")
+            at, _, length = window.partition("+")
+            peak, at, length = float(peak), _seconds(at), _seconds(length)
+            return lambda t: peak if at <= t < at + length else rate
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid rate profile {spec!r}; expected one of: constant, ramp[:FROM], "
+                     "step:R1,R2,..., spike:PEAK@AT+LEN")
+
+
+class LoadEngine:
+    def __init__(self, conninfo, concurrency, stats, profile=None, connect_parallelism=CONNECT_PARALLELISM,
+                 workload=None):
+        """``profile(t)`` -> ops/s switches to open-loop scheduling; None runs closed loop
+
+        ``workload`` (a prepared ``load_workloads.Workload``) defaults to single-row inserts.
+        """
+        if not PSYCOPG_AVAILABLE:
+            raise RuntimeError("The load test needs psycopg 3: pip3 install 'psycopg[binary]'")
+        self.conninfo = conninfo
+        self.concurrency = concurrency
+        self.stats = stats
+        self.profile = profile
+        self.connect_parallelism = connect_parallelism
+        self.workload = workload or Workload.preset("insert")
+        self.connected = 0
+        self._stopping = None
+        self._connect_slots = None
+        self._queue = None
+        self._attempted = 0
+        self._all_attempted = None
+        self._started = None
+
+    @property
+    def backlog(self):
+        """Operations due but not yet picked up by a worker (open loop); counted as unsent once stopping"""
+        return self._queue.qsize() if self._queue is not None and not self.stopping else 0
+
+    def stop(self):
+        """Finish in-flight operations, then close every connection"""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    @property
+    def stopping(self):
+        return self._stopping is not None and self._stopping.is_set()
+
+    async def _connect(self):
+        """A new connection, or None (recorded as a connect failure) after a short pause"""
+        try:
+            async with self._connect_slots:
+                conn = await psycopg.AsyncConnection.connect(
+                    self.conninfo, autocommit=True, connect_timeout=CONNECT_TIMEOUT
+                )
+        except psycopg.Error as e:
+            self.stats['connect_failures'] += 1
+            self._error(e)
+            await asyncio.sleep(RECONNECT_DELAY)
+            return None
+        self.connected += 1
+        return conn
+
+    def _error(self, e):
+        errors = self.stats['errors']
+        errors.append(" ".join(str(e).split()) or type(e).__name__)
+        if len(errors) > MAX_ERRORS:
+            del errors[0]
+
+    def _record(self, op, latency_ms=None, error=None):
+        # Workers share one event loop thread, so no lock is needed
+        stats = self.stats
+        stats['total_writes'] += 1
+        stats['ops'][op] += 1
+        if error is None:
+            stats['successful_writes'] += 1
+            stats['latency'].record(latency_ms)
+            stats['op_latency'][op].record(latency_ms)
+        else:
+            stats['failed_writes'] += 1
+            self._error(error)
+
+    async def _next_op(self):
+        """Intended start time of the next operation; None once the run is over"""
+        if self._queue is None:
+            await self._started.wait()
+            return None if self.stopping else time.perf_counter()
+        return await self._queue.get()
+
+    async def _worker(self):
+        conn = None
+        attempted = False
+        try:
+            while not self.stopping:
+                if conn is None:
+                    conn = await self._connect()
+                    if not attempted:
+                        attempted = True
+                        self._attempted += 1
+                        if self._attempted == self.concurrency:
+                            self._all_attempted.set()
+                    if conn is None:
+                        continue
+                intended = await self._next_op()
+                if intended is None:
+                    break
+                op, sql, params = self.workload.next()
+                try:
+                    await conn.execute(sql, params)
+                    self._record(op, latency_ms=(time.perf_counter() - intended) * 1000)
+                except psycopg.Error as e:
+                    self._record(op, error=e)
+                    if conn.closed or conn.broken:
+                        self.connected -= 1
+                        await conn.close()
+                        conn = None
+        finally:
+            if conn is not None:
+                self.connected -= 1
+                await conn.close()
+
+    async def _dispatch(self, start):
+        """Queue each operation at its intended start time, following the rate profile"""
+        intended = start
+        while True:
+            now = time.perf_counter()
+            # Everything due is released at once: a stalled cluster builds a backlog, it never slows the schedule
+            while intended <= now:
+                rate = self.profile(intended - start)
+                if rate <= 0:
+                    intended += IDLE_STEP
+                    continue
+                self._queue.put_nowait(intended)
+                intended += 1 / rate
+            self.stats['target_rate'] = self.profile(now - start)
+            await asyncio.sleep(max(0.0, intended - time.perf_counter()))
+
+    async def run(self, duration, on_tick=None, tick=0.5, start_gate=None):
+        """Run the workers for ``duration`` seconds or until stopped; ``on_tick(elapsed)`` drives the live view
+
+        ``start_gate`` (async) is awaited once every worker has tried to connect, before the clock starts.
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._connect_slots = asyncio.Semaphore(self.connect_parallelism)
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not the main thread or not supported (Windows): Ctrl-C raises as usual
+        self._all_attempted = asyncio.Event()
+        self._started = asyncio.Event()
+        self._queue = asyncio.Queue() if self.profile else None
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        dispatcher = None
+        elapsed = 0.0
+        try:
+            # The clock starts once every worker has tried to connect, so the schedule is not eaten by handshakes
+            waits = [asyncio.create_task(self._all_attempted.wait()), asyncio.create_task(self._stopping.wait())]
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+            for wait in waits:
+                wait.cancel()
+            if start_gate is not None and not self.stopping:
+                await start_gate()
+            start = time.perf_counter()
+            self._started.set()
+            if self.profile:
+                dispatcher = asyncio.create_task(self._dispatch(start))
+            while not self.stopping and elapsed < duration:
+                if on_tick:
+                    on_tick(elapsed)
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), min(tick, duration - elapsed))
+                except asyncio.TimeoutError:
+                    pass
+                elapsed = time.perf_counter() - start
+        finally:
+            self.stop()
+            self._started.set()
+            if dispatcher is not None:
+                dispatcher.cancel()
+            if self._queue is not None:
+                # Operations that came due but were never sent; then wake every idle worker to exit
+                self.stats['unsent'] = self._queue.qsize()
+                while not self._queue.empty():
+                    self._queue.get_nowait()
+                for _ in workers:
+                    self._queue.put_nowait(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError):
+                pass
+        return elapsed
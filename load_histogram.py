@@ -0,0 +1,188 @@
+"""Fixed-memory HDR-style latency histograms for the load test.
+
+Values are recorded in whole microseconds. Each power-of-two range is split
+into 128 linear sub-buckets, so any recorded value is within 1% of its
+bucket. The exact maximum is kept alongside the counts. A histogram has the
+same size (about 30 KB) whether it holds ten samples or a billion, and two
+histograms merge by adding their counts.
+
+A histogram's words (count, max, then the bucket counts, all unsigned 64-bit)
+can live in any writable buffer, such as an mmap shared with other
+processes. ``LatencyRecorder`` lays out a whole-run histogram plus a ring of
+one-second histograms in a single buffer, for sliding windows.
+"""
+import json
+import time
+from array import array
+
+SUB_BUCKET_BITS = 8
+# Largest recordable value, about 19 hours; anything above is clamped
+HIGHEST_US = 2 ** 36 - 1
+
+_SUB_HALF = 1 << (SUB_BUCKET_BITS - 1)
+COUNTS = (HIGHEST_US.bit_length() - SUB_BUCKET_BITS + 2) * _SUB_HALF
+_COUNT, _MAX, _HEADER = 0, 1, 2
+HIST_WORDS = _HEADER + COUNTS
+
+# Seconds of one-second histograms kept for sliding windows
+WINDOW_SECONDS = 60
+_SLOT_WORDS = 1 + HIST_WORDS
+RECORDER_WORDS = HIST_WORDS + (WINDOW_SECONDS + 1) * _SLOT_WORDS
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+
+def _index(us):
+    bucket = max(0, us.bit_length() - SUB_BUCKET_BITS)
+    return ((bucket + 1) << (SUB_BUCKET_BITS - 1)) + (us >> bucket) - _SUB_HALF
+
+
+def _highest(index):
+    """Largest value (us) that lands in the bucket at ``index``"""
+    bucket = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    sub = (index & (_SUB_HALF - 1)) + _SUB_HALF
+    if bucket < 0:
+        bucket, sub = 0, sub - _SUB_HALF
+    return ((sub + 1) << bucket) - 1
+
+
+def _words(buffer, offset, length):
+    if buffer is None:
+        return array("Q", bytes(8 * length))
+    return memoryview(buffer).cast("B")[8 * offset:8 * (offset + length)].cast("Q")
+
+
+def label(pct):
+    return f"p{pct:g}"
+
+
+class Histogram:
+    def __init__(self, buffer=None, offset=0):
+        """Counts live in ``buffer`` (64-bit words from ``offset``); a private array when None"""
+        self.words = _words(buffer, offset, HIST_WORDS)
+
+    @property
+    def count(self):
+        return self.words[_COUNT]
+
+    @property
+    def max_ms(self):
+        return self.words[_MAX] / 1000 if self.words[_COUNT] else None
+
+    def record(self, ms):
+        us = min(HIGHEST_US, max(0, int(ms * 1000)))
+        words = self.words
+        words[_HEADER + _index(us)] += 1
+        words[_COUNT] += 1
+        if us > words[_MAX]:
+            words[_MAX] = us
+
+    def add(self, other):
+        """Merge ``other``'s samples into this histogram"""
+        mine, theirs = self.words, other.words
+        if not theirs[_COUNT]:
+            return self
+        for i in range(_HEADER, HIST_WORDS):
+            n = theirs[i]
+            if n:
+                mine[i] += n
+        mine[_COUNT] += theirs[_COUNT]
+        mine[_MAX] = max(mine[_MAX], theirs[_MAX])
+        return self
+
+    def reset(self):
+        self.words[:] = array("Q", bytes(8 * HIST_WORDS))
+
+    def percentiles(self, pcts=PERCENTILES):
+        """{"p50": ms, ..., "max": ms, "count": n}; a percentile is its bucket's highest value, capped by max"""
+        words = self.words
+        # Summed from the buckets: another process may be recording into them while this one reads
+        total = sum(words[_HEADER:])
+        result = {"count": total}
+        if not total:
+            return {**result, **{label(p): None for p in pcts}, "max": None}
+        ranks = sorted((max(1, -(-total * p // 100)), p) for p in pcts)
+        seen = 0
+        pending = iter(ranks)
+        rank, pct = next(pending)
+        for i in range(_HEADER, HIST_WORDS):
+            seen += words[i]
+            while seen >= rank:
+                result[label(pct)] = min(_highest(i - _HEADER), words[_MAX]) / 1000
+                rank, pct = next(pending, (None, None))
+                if rank is None:
+                    break
+            if rank is None:
+                break
+        result["max"] = words[_MAX] / 1000
+        return result
+
+    def to_dict(self):
+        words = self.words
+        return {
+            "unit": "us", "sub_bucket_bits": SUB_BUCKET_BITS,
+            "count": words[_COUNT], "max_us": words[_MAX],
+            "counts": {str(i): words[_HEADER + i] for i in range(COUNTS) if words[_HEADER + i]},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("sub_bucket_bits") != SUB_BUCKET_BITS or data.get("unit") != "us":
+            raise ValueError("Histogram was recorded with a different bucket layout")
+        hist = cls()
+        for i, n in data["counts"].items():
+            hist.words[_HEADER + int(i)] = n
+        hist.words[_COUNT] = data["count"]
+        hist.words[_MAX] = data["max_us"]
+        return hist
+
+
+class LatencyRecorder:
+    """Whole-run histogram plus one histogram per wall-clock second, for sliding windows"""
+
+    def __init__(self, buffer=None, offset=0):
+        if buffer is None:
+            buffer, offset = bytearray(8 * RECORDER_WORDS), 0
+        self.total = Histogram(buffer, offset)
+        base = offset + HIST_WORDS
+        self._stamps = [_words(buffer, base + s * _SLOT_WORDS, 1) for s in range(WINDOW_SECONDS + 1)]
+        self._seconds = [Histogram(buffer, base + s * _SLOT_WORDS + 1) for s in range(WINDOW_SECONDS + 1)]
+
+    def record(self, ms):
+        now = int(time.time())
+        slot = now % (WINDOW_SECONDS + 1)
+        if self._stamps[slot][0] != now:
+            # Zero the counts before stamping, as in shared_latency
+            self._seconds[slot].reset()
+            self._stamps[slot][0] = now
+        self._seconds[slot].record(ms)
+        self.total.record(ms)
+
+    def window(self, seconds=10, into=None):
+        """Merged histogram of the last ``seconds`` (including the current, partial one)"""
+        merged = into if into is not None else Histogram()
+        now = int(time.time())
+        for stamp, hist in zip(self._stamps, self._seconds):
+            if now - min(seconds, WINDOW_SECONDS) < stamp[0] <= now:
+                merged.add(hist)
+        return merged
+
+    def second(self, second, into):
+        """Merge the samples of wall-clock ``second`` into ``into``, if it is still in the ring"""
+        slot = second % (WINDOW_SECONDS + 1)
+        if self._stamps[slot][0] == second:
+            into.add(self._seconds[slot])
+        return into
+
+
+def save(path, hist, **meta):
+    """Write ``hist`` and its percentiles to a JSON file, with ``meta`` describing the run"""
+    with open(path, "w") as f:
+        json.dump({**meta, "summary": hist.percentiles(), "histogram": hist.to_dict()}, f, indent=2)
+
+
+def load(path):
+    """(histogram, metadata) from a file written by ``save``"""
+    with open(path) as f:
+        data = json.load(f)
+    return Histogram.from_dict(data.pop("histogram")), data
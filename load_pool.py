@@ -0,0 +1,287 @@
+"""Multi-process load generation for ``demo_operations.py --load-test --processes N``.
+
+One ``LoadEngine`` runs on a single core. A pool of N processes splits the
+connections and any open-loop rate between N engines. Each process records
+its counters and latency histograms into its own block of a shared mmap
+file. Nothing is sent per operation. The parent reads every block to
+refresh the same stats dict and live table as a single engine. Histograms
+are only merged when the table reads them, and each second that is over is
+merged once. A process writes its last errors to a file as it exits; the
+parent merges them into the stats at shutdown.
+
+Every process connects first. The parent then starts all the clocks at
+once, so the schedule and duration line up across processes.
+"""
+import asyncio
+import json
+import mmap
+import multiprocessing
+import os
+import tempfile
+import time
+
+from load_engine import CONNECT_PARALLELISM, MAX_ERRORS, PSYCOPG_AVAILABLE, LoadEngine, parse_profile
+from load_histogram import HIST_WORDS, RECORDER_WORDS, WINDOW_SECONDS, Histogram, LatencyRecorder
+from load_workloads import OPERATIONS, Workload
+
+# Counters published by each process, one 64-bit word each
+FIELDS = ("total_writes", "successful_writes", "failed_writes", "connect_failures", "unsent",
+          "connected", "backlog", "target_rate_milli", "attempted", "finished") + tuple(f"op_{op}" for op in OPERATIONS)
+_FIELD = {name: i for i, name in enumerate(FIELDS)}
+_GO, _STOP, _CONTROL = 0, 1, 2
+_BLOCK_WORDS = len(FIELDS) + RECORDER_WORDS + len(OPERATIONS) * HIST_WORDS
+# How often a process publishes its connection count and backlog, and checks for stop
+PUBLISH_INTERVAL = 0.1
+# Grace period for a process to finish in-flight work after the run, before it is terminated
+EXIT_TIMEOUT = 30
+
+
+def _size(processes):
+    return 8 * (_CONTROL + processes * _BLOCK_WORDS)
+
+
+def _errors_path(path, index):
+    return f"{path}.{index}.errors"
+
+
+class _Block:
+    """One process's counters and latency recorder inside the shared file"""
+
+    def __init__(self, mm, index):
+        offset = _CONTROL + index * _BLOCK_WORDS
+        self.control = memoryview(mm).cast("B")[:8 * _CONTROL].cast("Q")
+        self.fields = memoryview(mm).cast("B")[8 * offset:8 * (offset + len(FIELDS))].cast("Q")
+        self.latency = LatencyRecorder(mm, offset + len(FIELDS))
+        offset += len(FIELDS) + RECORDER_WORDS
+        self.op_latency = {op: Histogram(mm, offset + i * HIST_WORDS) for i, op in enumerate(OPERATIONS)}
+
+    def __getitem__(self, key):
+        return self.fields[_FIELD[key]]
+
+    def __setitem__(self, key, value):
+        self.fields[_FIELD[key]] = value
+
+
+class _OpCounts:
+    """Per-operation counters of a block, indexed like the stats dict's 'ops'"""
+
+    def __init__(self, block):
+        self.block = block
+
+    def __getitem__(self, op):
+        return self.block[f"op_{op}"]
+
+    def __setitem__(self, op, value):
+        self.block[f"op_{op}"] = value
+
+
+class _SharedStats:
+    """The engine's stats dict, with counters and latencies in a shared block"""
+
+    def __init__(self, block):
+        self.block = block
+        self.local = {'errors': [], 'latency': block.latency, 'ops': _OpCounts(block), 'op_latency': block.op_latency}
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        if key == 'target_rate':
+            return self.block['target_rate_milli'] / 1000
+        return self.block[key]
+
+    def __setitem__(self, key, value):
+        if key in self.local:
+            self.local[key] = value
+        elif key == 'target_rate':
+            self.block['target_rate_milli'] = int(value * 1000)
+        else:
+            self.block[key] = value
+
+
+class _MergedOpLatency:
+    """Per-operation histograms over every process, merged when one is read"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def __getitem__(self, op):
+        merged = Histogram()
+        for block in self.blocks:
+            merged.add(block.op_latency[op])
+        return merged
+
+
+class _MergedLatency:
+    """Latency over every process, merged from the shared blocks when read"""
+
+    def __init__(self, recorders):
+        self.recorders = recorders
+        # Wall-clock second -> its histogram over every process, once that second is over
+        self._seconds = {}
+
+    @property
+    def total(self):
+        merged = Histogram()
+        for recorder in self.recorders:
+            merged.add(recorder.total)
+        return merged
+
+    def _second(self, second, now):
+        merged = self._seconds.get(second)
+        if merged is None:
+            merged = Histogram()
+            for recorder in self.recorders:
+                recorder.second(second, into=merged)
+            if second < now:
+                self._seconds[second] = merged
+        return merged
+
+    def window(self, seconds=10):
+        now = int(time.time())
+        seconds = min(seconds, WINDOW_SECONDS)
+        for second in [s for s in self._seconds if s <= now - WINDOW_SECONDS]:
+            del self._seconds[second]
+        merged = Histogram()
+        for second in range(now - seconds + 1, now + 1):
+            merged.add(self._second(second, now))
+        return merged
+
+
+def _child(path, index, processes, conninfo, concurrency, duration, rate, profile, workload):
+    with open(path, "r+b") as f:
+        mm = mmap.mmap(f.fileno(), _size(processes))
+    block = _Block(mm, index)
+    stats = _SharedStats(block)
+    shape = parse_profile(profile, rate, duration) if rate else None
+    engine = LoadEngine(conninfo, concurrency, stats,
+                        profile=(lambda t: shape(t) / processes) if shape else None,
+                        connect_parallelism=max(1, CONNECT_PARALLELISM // processes), workload=workload)
+
+    def publish(elapsed=None):
+        block['connected'] = engine.connected
+        block['backlog'] = engine.backlog
+        if block.control[_STOP]:
+            engine.stop()
+
+    async def start_gate():
+        block['attempted'] = 1
+        while not block.control[_GO] and not engine.stopping:
+            publish()
+            await asyncio.sleep(PUBLISH_INTERVAL / 10)
+
+    try:
+        asyncio.run(engine.run(duration, on_tick=publish, tick=PUBLISH_INTERVAL, start_gate=start_gate))
+    except KeyboardInterrupt:
+        pass  # Ctrl-C before the engine bound it; the parent reports what was recorded
+    finally:
+        publish()
+        with open(_errors_path(path, index), "w") as f:
+            json.dump(stats['errors'], f)
+        block['finished'] = 1
+
+
+class LoadPool:
+    def __init__(self, conninfo, concurrency, stats, processes, rate=None, profile="constant", workload=None):
+        """Same interface as ``LoadEngine``; ``concurrency`` and ``rate`` are totals over every process
+
+        A prepared ``workload`` is copied to each process once, keyspace included.
+        """
+        if not PSYCOPG_AVAILABLE:
+            raise RuntimeError("The load test needs psycopg 3: pip3 install 'psycopg[binary]'")
+        self.conninfo = conninfo
+        self.concurrency = concurrency
+        self.stats = stats
+        self.processes = max(1, min(processes, concurrency))
+        self.rate = rate
+        self.profile = profile if rate else None
+        self.workload = workload or Workload.preset("insert")
+        self._blocks = []
+        self._latency = None
+
+    @property
+    def connected(self):
+        return sum(b['connected'] for b in self._blocks)
+
+    @property
+    def backlog(self):
+        return sum(b['backlog'] for b in self._blocks)
+
+    def _collect(self):
+        """Refresh ``stats`` from every process's block"""
+        for key in ('total_writes', 'successful_writes', 'failed_writes', 'connect_failures', 'unsent'):
+            self.stats[key] = sum(b[key] for b in self._blocks)
+        self.stats['target_rate'] = sum(b['target_rate_milli'] for b in self._blocks) / 1000 if self.rate else None
+        self.stats['latency'] = self._latency
+        self.stats['ops'] = {op: sum(b[f"op_{op}"] for b in self._blocks) for op in OPERATIONS}
+        self.stats['op_latency'] = _MergedOpLatency(self._blocks)
+
+    def run(self, duration, on_tick=None, tick=0.5):
+        """Run every process for ``duration`` seconds or until Ctrl-C; returns elapsed seconds"""
+        fd, path = tempfile.mkstemp(prefix="chaos-load-", suffix=".mmap")
+        try:
+            os.ftruncate(fd, _size(self.processes))
+            mm = mmap.mmap(fd, _size(self.processes))
+        finally:
+            os.close(fd)
+        self._blocks = [_Block(mm, i) for i in range(self.processes)]
+        self._latency = _MergedLatency([b.latency for b in self._blocks])
+        control = self._blocks[0].control
+        self._collect()
+
+        procs = []
+        for i in range(self.processes):
+            share = self.concurrency // self.processes + (i < self.concurrency % self.processes)
+            proc = multiprocessing.Process(
+                target=_child, daemon=True,
+                args=(path, i, self.processes, self.conninfo, share, duration, self.rate, self.profile or "constant",
+                      self.workload),
+            )
+            proc.start()
+            procs.append(proc)
+        elapsed = 0.0
+        try:
+            # Every process has tried to connect its share before any clock starts
+            while not all(b['attempted'] for b in self._blocks):
+                for i, proc in enumerate(procs):
+                    if not proc.is_alive() and not self._blocks[i]['attempted']:
+                        raise RuntimeError(f"Load process {i} exited with code {proc.exitcode} before starting")
+                if on_tick:
+                    self._collect()
+                    on_tick(elapsed)
+                time.sleep(PUBLISH_INTERVAL)
+            control[_GO] = 1
+            start = time.perf_counter()
+            while elapsed < duration and not all(b['finished'] for b in self._blocks):
+                if on_tick:
+                    self._collect()
+                    on_tick(elapsed)
+                time.sleep(min(tick, duration - elapsed))
+                elapsed = time.perf_counter() - start
+        except KeyboardInterrupt:
+            pass  # The processes got the same Ctrl-C and are draining
+        finally:
+            control[_STOP] = 1
+            deadline = time.monotonic() + EXIT_TIMEOUT
+            for proc in procs:
+                proc.join(max(0.0, deadline - time.monotonic()))
+                if proc.is_alive():
+                    proc.terminate()
+            # The parent keeps its mapping for the final stats; the file itself is no longer needed
+            os.unlink(path)
+            self._collect()
+            self.stats['errors'] = self._merge_errors(path)[-MAX_ERRORS:]
+        return elapsed
+
+    def _merge_errors(self, path):
+        """Every process's last errors, read from the files they wrote as they exited"""
+        errors = []
+        for i in range(self.processes):
+            try:
+                with open(_errors_path(path, i)) as f:
+                    errors.extend(json.load(f))
+                os.unlink(_errors_path(path, i))
+            except FileNotFoundError:
+                pass  # the process was terminated, or never got that far
+            except ValueError:
+                os.unlink(_errors_path(path, i))  # terminated mid-write
+        return errors
@@ -0,0 +1,172 @@
+"""YCSB-style workload mixes for the load test, on ``demo_transactions``.
+
+A workload is a weighted mix of operations (point reads, updates, inserts,
+short scans) and a key distribution. The keys are ids already in the
+table: up to ``KEYSPACE_LIMIT`` of them are loaded once before the run.
+Inserted rows do not join the keyspace, so the hot set stays fixed for the
+whole run. Rows can carry a ``payload`` column of a configurable size.
+
+    uniform   every key equally likely
+    zipfian   YCSB's zipfian (theta 0.99): a few keys take most operations
+    hotspot   HOTSPOT_OPS of operations go to the first HOTSPOT_KEYS of the keys
+"""
+import os
+import random
+
+OPERATIONS = ("read", "update", "insert", "scan")
+DISTRIBUTIONS = ("uniform", "zipfian", "hotspot")
+
+WORKLOADS = {
+    "insert": {"mix": {"insert": 100}, "distribution": "uniform"},
+    "ycsb-a": {"mix": {"read": 50, "update": 50}, "distribution": "zipfian"},
+    "ycsb-b": {"mix": {"read": 95, "update": 5}, "distribution": "zipfian"},
+    "ycsb-c": {"mix": {"read": 100}, "distribution": "zipfian"},
+    "ycsb-e": {"mix": {"scan": 95, "insert": 5}, "distribution": "zipfian"},
+    # Mostly point reads on a hot key set, like the production traffic this demo stands in for
+    "hot-reads": {"mix": {"read": 80, "update": 15, "insert": 5}, "distribution": "hotspot"},
+}
+
+# Ids loaded as the keyspace, and rows inserted first if the table has fewer than MIN_KEYS
+KEYSPACE_LIMIT = 100_000
+MIN_KEYS = 1000
+ZIPFIAN_THETA = 0.99
+HOTSPOT_KEYS = 0.2
+HOTSPOT_OPS = 0.8
+# Distinct random payloads to pick from, so generating one costs nothing per operation
+PAYLOAD_VARIANTS = 64
+
+_COLUMNS = "id, ts, amount"
+
+
+def parse_mix(spec):
+    """{"read": 80, "update": 20} from "read=80,update=20" """
+    mix = {}
+    for part in spec.split(","):
+        op, _, weight = part.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation {op!r} in mix; expected {', '.join(OPERATIONS)}")
+        try:
+            mix[op] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid weight for {op} in mix {spec!r}; expected e.g. read=80,update=20")
+    return mix
+
+
+class Workload:
+    def __init__(self, mix, distribution="uniform", row_size=0, scan_length=10, name=None):
+        mix = {op: w for op, w in mix.items() if w > 0}
+        if not mix:
+            raise ValueError("A workload mix needs at least one operation with a positive weight")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown key distribution {distribution!r}; expected {', '.join(DISTRIBUTIONS)}")
+        if row_size < 0 or scan_length < 1:
+            raise ValueError("Row size must be >= 0 and scan length >= 1")
+        self.name = name or "custom"
+        self.mix = mix
+        self.distribution = distribution
+        self.row_size = row_size
+        self.scan_length = scan_length
+        self.keys = []
+        self._ops = list(mix)
+        self._weights = [mix[op] for op in self._ops]
+        self._payloads = [os.urandom(row_size).hex()[:row_size] for _ in range(PAYLOAD_VARIANTS)] if row_size else []
+        self._zipf = None
+
+    @classmethod
+    def preset(cls, name, mix=None, distribution=None, row_size=None, scan_length=None):
+        """A named workload from WORKLOADS, with any of its settings overridden"""
+        if name not in WORKLOADS:
+            raise ValueError(f"Unknown workload {name!r}; expected one of: {', '.join(WORKLOADS)}")
+        base = WORKLOADS[name]
+        return cls(
+            parse_mix(mix) if mix else base["mix"],
+            distribution=distribution or base["distribution"],
+            row_size=row_size if row_size is not None else base.get("row_size", 0),
+            scan_length=scan_length or base.get("scan_length", 10),
+            name=name,
+        )
+
+    @property
+    def needs_keys(self):
+        return any(op in self.mix for op in ("read", "update", "scan"))
+
+    def describe(self):
+        total = sum(self.mix.values())
+        mix = ", ".join(f"{self.mix[op] / total:.0%} {op}" for op in OPERATIONS if op in self.mix)
+        extra = f", {self.row_size} B payload" if self.row_size else ""
+        return f"{self.name} ({mix}; {self.distribution} keys{extra})"
+
+    def prepare(self, conn):
+        """Add the payload column if needed, seed rows, and load the keyspace (``conn`` is a DB-API connection)"""
+        cursor = conn.cursor()
+        if self.row_size:
+            cursor.execute("ALTER TABLE demo_transactions ADD COLUMN IF NOT EXISTS payload STRING")
+            conn.commit()
+        if self.needs_keys:
+            cursor.execute("SELECT count(*) FROM (SELECT 1 FROM demo_transactions LIMIT %s) AS t", (MIN_KEYS,))
+            missing = MIN_KEYS - cursor.fetchone()[0]
+            if missing > 0:
+                cursor.execute(
+                    "INSERT INTO demo_transactions (ts, amount) "
+                    "SELECT now(), (random() * 999)::INT + 1 FROM generate_series(1, %s)", (missing,)
+                )
+                conn.commit()
+            cursor.execute("SELECT id::STRING FROM demo_transactions LIMIT %s", (KEYSPACE_LIMIT,))
+            # Shuffled so the hottest ranks are not neighbours in the primary key (and on one range)
+            self.keys = [row[0] for row in cursor.fetchall()]
+            random.shuffle(self.keys)
+            conn.commit()
+        cursor.close()
+        if self.distribution == "zipfian" and self.keys:
+            self._zipf = _zipfian_constants(len(self.keys), ZIPFIAN_THETA)
+
+    def _key(self):
+        n = len(self.keys)
+        if self.distribution == "zipfian":
+            index = _zipfian(self._zipf)
+        elif self.distribution == "hotspot":
+            hot = max(1, int(n * HOTSPOT_KEYS))
+            index = random.randrange(hot) if random.random() < HOTSPOT_OPS or hot == n else random.randrange(hot, n)
+        else:
+            index = random.randrange(n)
+        return self.keys[min(index, n - 1)]
+
+    def next(self):
+        """(operation, sql, params) for the next operation"""
+        op = random.choices(self._ops, self._weights)[0]
+        amount = random.randint(1, 1000)
+        if op == "insert":
+            if self._payloads:
+                return op, "INSERT INTO demo_transactions (ts, amount, payload) VALUES (now(), %s, %s)", (
+                    amount, random.choice(self._payloads))
+            return op, "INSERT INTO demo_transactions (ts, amount) VALUES (now(), %s)", (amount,)
+        key = self._key()
+        if op == "read":
+            return op, f"SELECT {_COLUMNS} FROM demo_transactions WHERE id = %s::UUID", (key,)
+        if op == "update":
+            if self._payloads:
+                return op, "UPDATE demo_transactions SET amount = %s, payload = %s WHERE id = %s::UUID", (
+                    amount, random.choice(self._payloads), key)
+            return op, "UPDATE demo_transactions SET amount = %s WHERE id = %s::UUID", (amount, key)
+        return op, f"SELECT {_COLUMNS} FROM demo_transactions WHERE id >= %s::UUID ORDER BY id LIMIT %s", (
+            key, random.randint(1, self.scan_length))
+
+
+def _zipfian_constants(n, theta):
+    """Constants of the Gray et al. zipfian generator used by YCSB, for ranks 0..n-1"""
+    zetan = sum(1 / i ** theta for i in range(1, n + 1))
+    zeta2 = 1 + 0.5 ** theta
+    eta = (1 - (2 / n) ** (1 - theta)) / (1 - zeta2 / zetan) if n > 2 else 0.0
+    return n, theta, zetan, eta, 1 / (1 - theta)
+
+
+def _zipfian(constants):
+    n, theta, zetan, eta, alpha = constants
+    u = random.random()
+    uz = u * zetan
+    if uz < 1:
+        return 0
+    if uz < 1 + 0.5 ** theta:
+        return 1
+    return int(n * (eta * u - eta + 1) ** alpha)
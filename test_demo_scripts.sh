@@ -25,17 +25,17 @@ fi
 
 # Check Python dependencies
 echo -n "Checking Python dependencies... "
-python3 -c "import psycopg2, rich" 2>/dev/null
+python3 -c "import psycopg2, psycopg, rich" 2>/dev/null
 if [ $? -eq 0 ]; then
     echo -e "${GREEN}✓${NC}"
 else
     echo -e "${YELLOW}⚠${NC}"
-    echo "Missing packages. Installing psycopg2-binary, rich, tabulate..."
-    if pip3 install psycopg2-binary rich tabulate; then
+    echo "Missing packages. Installing psycopg2-binary, psycopg[binary], rich, tabulate..."
+    if pip3 install psycopg2-binary "psycopg[binary]" rich tabulate; then
         echo -e "${GREEN}✓ Packages installed${NC}"
     else
         echo -e "${RED}✗ Failed to install packages${NC}"
-        echo "Please install manually: pip3 install psycopg2-binary rich tabulate"
+        echo "Please install manually: pip3 install psycopg2-binary \"psycopg[binary]\" rich tabulate"
         exit 1
     fi
 fi